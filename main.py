@@ -30,6 +30,7 @@ save_gif = config.get('simulation').get('saving_options').get('save_gif', False)
 save_timewise_result_csv = config.get('simulation').get('saving_options').get('save_timewise_result_csv', False)
 save_agentwise_result_csv = config.get('simulation').get('saving_options').get('save_agentwise_result_csv', False)
 save_config_yaml = config.get('simulation').get('saving_options').get('save_config_yaml', False)
+save_event_log = config.get('simulation').get('saving_options').get('save_event_log', False)
 
 # Dynamically import the decision-making module
 decision_making_module_path = config['decision_making']['plugin']
@@ -85,6 +86,25 @@ container_spacing = 150  # 간격 값을 150으로 설정
 # Define container positions with updated spacing
 container_positions = [(screen_width - 100, 110 + i * (container_height + container_spacing)) for i in range(len(container_images))]
 
+# Task lifecycle bookkeeping: driven by events instead of rescanning `tasks` every tick
+from modules.events import event_bus, TaskCreated, TaskCompleted
+from modules.claims import claim_registry
+from modules.cost_matrix import cost_matrix
+if save_event_log:
+    event_bus.enable_event_log()
+remaining_task_count = 0
+
+def on_task_created(event):
+    global remaining_task_count
+    remaining_task_count += 1
+
+def on_task_completed(event):
+    global remaining_task_count
+    remaining_task_count -= 1
+
+event_bus.subscribe(TaskCreated, on_task_created)
+event_bus.subscribe(TaskCompleted, on_task_completed)
+
 # Initialize tasks
 from modules.task import generate_tasks
 max_task_count = config['tasks']['quantity']  # config.yaml에 정의된 task 수
@@ -93,6 +113,11 @@ tasks = generate_tasks()
 # Initialize agents with behavior trees, giving them the information of current tasks
 from modules.agent import generate_agents
 agents = generate_agents(tasks)
+from modules.behavior_tree import run_batch_decision_making, delegate_to_plugin
+from modules.metrics import message_traffic_monitor, MessageTrafficMonitor
+from modules.profiler import bt_profiler, BehaviorTreeProfiler
+from modules.watchdog import decision_watchdog, DecisionWatchdog
+from modules.trace import trace_ring_buffer
 
 # Pre-rendered text for performance improvement
 mission_completed_text = pre_render_text("MISSION COMPLETED", 72, (0, 0, 0))
@@ -157,14 +182,33 @@ async def game_loop():
 
         if not game_paused and not mission_completed:
             # Run behavior trees for each agent without rendering
+            event_bus.set_simulation_time(simulation_time)
+            claim_registry.set_simulation_time(simulation_time)
+            cost_matrix.new_tick()
+            run_batch_decision_making(agents)
             for agent in agents:
-                agent.assign_nearest_task() 
-                await agent.run_tree()    
+                if not delegate_to_plugin: # Otherwise, the plugin's decision is the agent's assigned task
+                    agent.assign_nearest_task() 
+                if agent.compiled_tree is not None:
+                    agent.tick_tree() # Synchronous; no coroutine per node
+                else:
+                    await agent.run_tree()
                 agent.update()
 
+            # Check the compute budget of the plugin's decisions in this tick
+            if delegate_to_plugin:
+                decision_watchdog.end_tick(simulation_time)
+                if decision_watchdog.abort_requested:
+                    print(f"[ERROR] Decision budget exceeded; the simulation is aborted at t={simulation_time:.2f}")
+                    running = False
+
+            # Close the message traffic record of this tick
+            if message_traffic_monitor.enabled:
+                message_traffic_record = message_traffic_monitor.end_tick()
+
             # Status retrieval
             simulation_time += sampling_time
-            tasks_left = sum(1 for task in tasks if not task.completed)
+            tasks_left = remaining_task_count
             if tasks_left == 0 and len(tasks) < max_task_count:
                 new_task = generate_tasks(task_id_start=len(tasks))
                 tasks.append(new_task)
@@ -187,16 +231,19 @@ async def game_loop():
             if save_timewise_result_csv:
                 agents_total_distance_moved = sum(agent.distance_moved for agent in agents)
                 agents_total_task_amount_done = sum(agent.task_amount_done for agent in agents)
-                remaining_tasks = len([task for task in tasks if not task.completed])
+                remaining_tasks = remaining_task_count
                 tasks_total_amount_left = sum(task.amount for task in tasks)
                 
-                data_records.append([
+                data_record = [
                     simulation_time, 
                     agents_total_distance_moved,
                     agents_total_task_amount_done,
                     remaining_tasks,
                     tasks_total_amount_left
-                ])
+                ]
+                if message_traffic_monitor.enabled:
+                    data_record += message_traffic_record
+                data_records.append(data_record)
 
             # Rendering
             if rendering_mode == "Screen":
@@ -291,23 +338,57 @@ async def game_loop():
 
     # Save time series data
     if save_timewise_result_csv:        
-        csv_file_path = result_saver.save_to_csv("timewise", data_records, ['time', 'agents_total_distance_moved', 'agents_total_task_amount_done', 'remaining_tasks', 'tasks_total_amount_left'])          
+        timewise_labels = ['time', 'agents_total_distance_moved', 'agents_total_task_amount_done', 'remaining_tasks', 'tasks_total_amount_left']
+        if message_traffic_monitor.enabled:
+            timewise_labels += MessageTrafficMonitor.TIMEWISE_LABELS
+        csv_file_path = result_saver.save_to_csv("timewise", data_records, timewise_labels)          
         result_saver.plot_timewise_result(csv_file_path)
     
     # Save agent-wise data            
     if save_agentwise_result_csv:        
         variables_to_save = ['agent_id', 'task_amount_done', 'distance_moved']
         agentwise_results = result_saver.get_agentwise_results(agents, variables_to_save)                        
-        csv_file_path = result_saver.save_to_csv('agentwise', agentwise_results, variables_to_save)
+        agentwise_labels = variables_to_save
+        if message_traffic_monitor.enabled:
+            agentwise_labels = variables_to_save + MessageTrafficMonitor.AGENTWISE_LABELS
+            agentwise_results = [result + message_traffic_monitor.get_agentwise_record(agent.agent_id) for result, agent in zip(agentwise_results, agents)]
+        csv_file_path = result_saver.save_to_csv('agentwise', agentwise_results, agentwise_labels)
         
         result_saver.plot_boxplot(csv_file_path, variables_to_save[1:])
 
+    # Save the fan-out distribution of the message traffic
+    if message_traffic_monitor.enabled:
+        result_saver.save_to_csv('fanout', message_traffic_monitor.get_fanout_distribution(), ['fanout', 'count'])
+        print(f"Messages delivered: {message_traffic_monitor.total_messages_delivered} ({message_traffic_monitor.total_message_bytes_delivered} bytes)")
+
+    # Save task lifecycle event log
+    if save_event_log:
+        result_saver.save_to_csv('events', event_bus.get_event_log_records(), ['time', 'event', 'task_id', 'agent_id'])
+
+    # Save the compute statistics (and the run status) of the plugin's decisions
+    if delegate_to_plugin:
+        _, p99_time, _ = decision_watchdog.get_percentiles()
+        print(f"Decisions: {decision_watchdog.calls} calls, p99 {1000.0 * p99_time:.3f} ms, max {1000.0 * decision_watchdog.max_time:.3f} ms, status: {decision_watchdog.status}")
+        result_saver.save_to_csv('decide_stats', [decision_watchdog.get_record()], DecisionWatchdog.LABELS)
+
+    # Save behavior tree node profile
+    if bt_profiler.enabled:
+        bt_profiler.print_summary()
+        result_saver.save_to_csv('bt_profile', bt_profiler.get_records(), BehaviorTreeProfiler.LABELS)
+        bt_profiler.save_json(result_saver.get_result_file_path('bt_profile', 'json'))
+
     # Save yaml 
     if save_config_yaml:                
         result_saver.save_config_yaml()    
 
 def main():
-    asyncio.run(game_loop())
+    try:
+        asyncio.run(game_loop())
+    except Exception:
+        # Dump the most recent trace records (if the ring buffer is enabled) for post-mortem analysis
+        if trace_ring_buffer is not None:
+            trace_ring_buffer.dump(result_saver.get_result_file_path('trace', 'log'))
+        raise
 
 # Run the game
 if __name__ == "__main__":    
@@ -50,6 +50,9 @@ class MonteCarloAnalyzer:
         final_tasks_done = []
         quartile_distances = [[] for _ in range(4)]
         quartile_tasks_done = [[] for _ in range(4)]
+        total_message_bytes = []
+        mean_messages_per_tick = []
+        peak_message_bytes_per_tick = []
         
         for data in data_list:
             final_time = data['time'].iloc[-1]
@@ -59,6 +62,12 @@ class MonteCarloAnalyzer:
             final_times.append(final_time)
             final_distances.append(final_distance)
             final_tasks_done.append(final_tasks)
+
+            # Message traffic (only recorded when `simulation.message_traffic_metrics` is enabled)
+            if 'message_bytes_delivered' in data.columns:
+                total_message_bytes.append(data['message_bytes_delivered'].sum())
+                mean_messages_per_tick.append(data['messages_delivered'].mean())
+                peak_message_bytes_per_tick.append(data['message_bytes_delivered'].max())
             
             # Calculate quartiles
             quartile_indices = [int(len(data) * q) - 1 for q in [0.25, 0.5, 0.75, 1.0]]
@@ -75,7 +84,10 @@ class MonteCarloAnalyzer:
                 "final_distances": final_distances, 
                 "final_tasks_done": final_tasks_done, 
                 "quartile_distances": quartile_distances, 
-                "quartile_tasks_done": quartile_tasks_done}
+                "quartile_tasks_done": quartile_tasks_done,
+                "total_message_bytes": total_message_bytes,
+                "mean_messages_per_tick": mean_messages_per_tick,
+                "peak_message_bytes_per_tick": peak_message_bytes_per_tick}
 
     def analyze_agentwise_data(self, data_list):
         """Perform agentwise data analysis."""
@@ -85,6 +97,7 @@ class MonteCarloAnalyzer:
         average_distance_moved_per_agent = []
         std_task_amount_done = []
         std_distance_moved = []
+        average_message_bytes_sent_per_agent = []
         
         for data in data_list:
             task_amount_done = data['task_amount_done'].tolist()
@@ -101,13 +114,17 @@ class MonteCarloAnalyzer:
 
             std_task_amount_done.append(np.std(task_amount_done)/np.mean(task_amount_done))
             std_distance_moved.append(np.std(distance_moved)/np.mean(distance_moved))
+
+            if 'message_bytes_sent' in data.columns:
+                average_message_bytes_sent_per_agent.append(data['message_bytes_sent'].mean())
         
         return {"gini_coeff_task_amount_done": gini_coeff_task_amount_done, 
                 "gini_coeff_distance_moved": gini_coeff_distance_moved, 
                 "average_task_amount_done_per_agent": average_task_amount_done_per_agent, 
                 "average_distance_moved_per_agent": average_distance_moved_per_agent, 
                 "std_task_amount_done": std_task_amount_done, 
-                "std_distance_moved": std_distance_moved
+                "std_distance_moved": std_distance_moved,
+                "average_message_bytes_sent_per_agent": average_message_bytes_sent_per_agent
                 }
 
     def plot_box_plots(self, data, xticklabels, title, ylabel, filename, ylim = None):
@@ -205,6 +222,21 @@ class MonteCarloAnalyzer:
         # self.plot_box_plots([agentwise_case_data[case]["std_distance_moved"] for case in self.case_names],
         #                     self.xticklabels, 'Std/Ave of Distance Moved', 'Coefficient of Variation', 'std_distance_moved.png')        
 
+        # Message traffic plots, if every case recorded it
+        if all(timewise_case_data[case]["total_message_bytes"] for case in self.case_names):
+            self.plot_box_plots([timewise_case_data[case]["total_message_bytes"] for case in self.case_names],
+                                self.xticklabels, 'Total Message Traffic', 'Bytes', 'total_message_bytes.png')
+
+            self.plot_box_plots([timewise_case_data[case]["mean_messages_per_tick"] for case in self.case_names],
+                                self.xticklabels, 'Messages Delivered Per Tick', 'Messages', 'messages_per_tick.png')
+
+            self.plot_box_plots([timewise_case_data[case]["peak_message_bytes_per_tick"] for case in self.case_names],
+                                self.xticklabels, 'Peak Message Traffic Per Tick', 'Bytes', 'peak_message_bytes_per_tick.png')
+
+        if all(agentwise_case_data[case]["average_message_bytes_sent_per_agent"] for case in self.case_names):
+            self.plot_box_plots([agentwise_case_data[case]["average_message_bytes_sent_per_agent"] for case in self.case_names],
+                                self.xticklabels, 'Average Message Bytes Sent Per Agent', 'Bytes', 'agent_message_bytes_sent.png')
+
 
 
 if __name__ == "__main__":
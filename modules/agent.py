@@ -4,6 +4,12 @@ import copy
 from modules.behavior_tree import *
 from modules.utils import config, generate_positions, parse_behavior_tree
 from modules.task import task_colors
+from modules.metrics import message_traffic_monitor
+from modules.profiler import bt_profiler
+from modules.claims import claim_registry
+from modules.cost_matrix import cost_matrix
+from modules.blackboard import Blackboard
+from modules.trace import get_tracer
 from enum import Enum
 
 # Load agent configuration
@@ -15,11 +21,14 @@ agent_track_size = config['simulation']['agent_track_size']
 work_rate = config['agents']['work_rate']
 agent_communication_radius = config['agents']['communication_radius']
 agent_situation_awareness_radius = config.get('agents', {}).get('situation_awareness_radius', 0)
+event_triggered_broadcasting = config.get('agents', {}).get('event_triggered_broadcasting', False)
 font = pygame.font.Font(None, 15)
 
 # Load behavior tree
 behavior_tree_xml = config['agents']['behavior_tree_xml']
 xml_root = parse_behavior_tree(f"bt_xml/{behavior_tree_xml}")
+behavior_tree_template = BehaviorTreeTemplate(xml_root) # Parsed once and shared by all agents
+trace = get_tracer('agent')
 
 class AgentState(Enum):
     TO_DESTINATION = 1  # 작업을 목적지로 운반 중
@@ -39,16 +48,22 @@ class Agent:
         self.memory_location = []  # To draw track
         self.rotation = 0  # Initial rotation
         self.color = (0, 0, 255)  # Blue color
-        self.blackboard = {}
+        self.blackboard = Blackboard(behavior_tree_template.node_status_index)
 
         self.tasks_info = tasks_info # global info
         self.agents_info = None # global info
         self.communication_radius = agent_communication_radius
         self.situation_awareness_radius = agent_situation_awareness_radius
-        self.agents_nearby = []
+        self._agents_nearby = []
+        self.local_sensing_pending = False   # True if `local_message_receive()` is deferred to the first use (see `request_local_sensing()`)
+        self.message_version = 0             # Incremented whenever `message_to_share` is (re)published
         self.message_to_share = {}
-        self.messages_received = []
+        self._messages_received = []
+        self.neighbor_message_versions = {}  # key: neighbor agent_id (in range at the last receive); value: its message_version
+        self.neighbor_message_changed = {}   # key: neighbor agent_id; value: True if its message changed since last tick
+        self._changed_messages_received = [] # Messages of the last receive whose version changed
 
+        self.decision_maker = None           # Decision-making plugin instance (created with the behavior tree)
         self.assigned_task_id = None         # Local decision-making result.
         self.planned_tasks = []              # Local decision-making result.
         self.planned_destination = []
@@ -77,38 +92,21 @@ class Agent:
         self.image = pygame.transform.scale(self.image, (50, 50))
 
     def create_behavior_tree(self):
-        self.tree = self._create_behavior_tree()
-
-    # Agent's Behavior Tree
-    def _create_behavior_tree(self):
-        behavior_tree = self._parse_xml_to_bt(xml_root.find('BehaviorTree'))
-        return behavior_tree        
-    
-    def _parse_xml_to_bt(self, xml_node):
-        node_type = xml_node.tag
-        children = []
-
-        for child in xml_node:
-            children.append(self._parse_xml_to_bt(child))
-
-        if node_type in BehaviorTreeList.CONTROL_NODES:
-            control_class = globals()[node_type]  # Control class should be globally available
-            return control_class(node_type, children=children)
-        elif node_type in BehaviorTreeList.ACTION_NODES:
-            action_class = globals()[node_type]  # Action class should be globally available
-            return action_class(node_type, self)
-        elif node_type == "BehaviorTree": # Root
-            return children[0]
-        else:
-            raise ValueError(f"[ERROR] Unknown behavior node type: {node_type}")    
+        # The tree is shared by all agents; only the node states are per agent
+        self.tree = behavior_tree_template.root
+        self.compiled_tree = behavior_tree_template.compiled_tree
+        self.node_states = behavior_tree_template.create_node_states(self)
 
     def _reset_bt_action_node_status(self):
-        action_nodes = BehaviorTreeList.ACTION_NODES
-        self.blackboard = {key: None if key in action_nodes else value for key, value in self.blackboard.items()}
-
+        self.blackboard.reset_node_statuses()
 
+    def tick_tree(self):
+        self._reset_bt_action_node_status()
+        return self.compiled_tree.tick(self, self.blackboard)
 
     async def run_tree(self):
+        if self.compiled_tree is not None:
+            return self.tick_tree()
         self._reset_bt_action_node_status()
         return await self.tree.run(self, self.blackboard)
 
@@ -212,21 +210,87 @@ class Agent:
             vector.scale_to_length(max_value)
         return vector
 
+    @property
+    def message_to_share(self):
+        return self._message_to_share
+
+    @message_to_share.setter
+    def message_to_share(self, message):
+        # Every (re)assignment is treated as a new broadcast so that receivers can tell fresh content apart
+        self._message_to_share = message
+        self.message_version += 1
+
+    # Lazy local sensing: the communication phase runs on the first use of its results in the tick
+    def request_local_sensing(self):
+        self.local_sensing_pending = True
+
+    def _flush_local_sensing(self):
+        if self.local_sensing_pending:
+            self.local_sensing_pending = False
+            self.local_message_receive()
+
+    @property
+    def agents_nearby(self):
+        self._flush_local_sensing()
+        return self._agents_nearby
+
+    @property
+    def messages_received(self):
+        self._flush_local_sensing()
+        return self._messages_received
+
+    @messages_received.setter
+    def messages_received(self, messages):
+        self._flush_local_sensing() # Pending messages of this tick are received (and discarded) first, as in eager sensing
+        self._messages_received = messages
+
     def local_message_receive(self):
-        self.agents_nearby = self.get_agents_nearby()
-        for other_agent in self.agents_nearby:
-            if other_agent.agent_id != self.agent_id:                         
+        self.local_sensing_pending = False
+        self._agents_nearby = self.get_agents_nearby()
+        neighbor_message_versions = {}
+        neighbor_message_changed = {}
+        changed_messages_received = []
+        for other_agent in self._agents_nearby:
+            if other_agent.agent_id != self.agent_id:
+                # A neighbor that was out of range in the previous call counts as changed
+                changed = self.neighbor_message_versions.get(other_agent.agent_id) != other_agent.message_version
+                neighbor_message_versions[other_agent.agent_id] = other_agent.message_version
+                neighbor_message_changed[other_agent.agent_id] = changed
+                # Every neighbor's last message is delivered (a cached reference); receivers rebuild their view from it each tick
                 self.receive_message(other_agent.message_to_share)
+                if changed:
+                    changed_messages_received.append(other_agent.message_to_share)
+                if message_traffic_monitor.enabled and (changed or not event_triggered_broadcasting):
+                    # With event-triggered broadcasting, an unchanged message is not sent again (the receiver keeps its copy)
+                    message_traffic_monitor.record_delivery(other_agent, self)
                 # other_agent.receive_message(self.message_to_share)                          
+        self.neighbor_message_versions = neighbor_message_versions
+        self.neighbor_message_changed = neighbor_message_changed
+        self._changed_messages_received = changed_messages_received
+
+        return self._agents_nearby
+
+    def is_message_changed(self, agent_id):
+        """Whether the message of the neighbor `agent_id` changed since the previous `local_message_receive()`"""
+        self._flush_local_sensing()
+        return self.neighbor_message_changed.get(agent_id, False)
 
-        return self.agents_nearby
+    @property
+    def changed_messages_received(self):
+        """The messages of this tick whose version changed since the previous `local_message_receive()` (receivers may skip the others)"""
+        self._flush_local_sensing()
+        return self._changed_messages_received
 
 
     def reset_messages_received(self):
         self.messages_received = []
 
+    def discard_messages_received(self):
+        # Drops the messages received so far without running a pending communication phase (for plugins that do not read them)
+        self._messages_received = []
+
     def receive_message(self, message):
-        self.messages_received.append(message)            
+        self._messages_received.append(message)            
 
     def draw(self, screen):
         size = 10
@@ -252,8 +316,8 @@ class Agent:
         
 
     def draw_communication_topology(self, screen, agents):
-     # Draw lines to neighbor agents
-        for neighbor_agent in self.agents_nearby:
+     # Draw lines to neighbor agents (as of the last sensing; drawing does not trigger the communication phase)
+        for neighbor_agent in self._agents_nearby:
             if neighbor_agent.agent_id > self.agent_id:
                 neighbor_position = agents[neighbor_agent.agent_id].position
                 pygame.draw.line(screen, (200, 200, 200), (int(self.position.x), int(self.position.y)), (int(neighbor_position.x), int(neighbor_position.y)))
@@ -286,7 +350,7 @@ class Agent:
             pygame.draw.circle(screen, self.color, (self.position[0], self.position[1]), self.situation_awareness_radius, 1)
 
     def draw_path_to_assigned_tasks(self, screen):
-        if self.blackboard.get('loading', False):  # 'loading' 상태 확인
+        if self.blackboard.loading:  # 'loading' 상태 확인
             return
         # Starting position is the agent's current position
         start_pos = self.position
@@ -444,15 +508,16 @@ class Agent:
         """가장 가까운, 아직 완료되지 않은 작업을 찾고 할당"""
 
         # 디버깅: self.tasks_info 내용 출력
-        print(f"\nAgent {self.agent_id} - Task Info Check:")
-        for task in self.tasks_info:
-            print(f"  Task ID {task.task_id}, Completed: {task.completed}, Position: {task.position}")
+        if trace.debug_enabled:
+            trace.debug("\nAgent %d - Task Info Check:", self.agent_id)
+            for task in self.tasks_info:
+                trace.debug("  Task ID %d, Completed: %s, Position: %s", task.task_id, task.completed, task.position)
 
         # 모든 작업 중 완료되지 않은 작업과의 거리 계산 및 정렬
         tasks_with_distances = [
             (task, self.position.distance_to(task.position))
             for task in self.tasks_info
-            if not task.completed and not task.assigned  # 완료되지 않은 작업만 포함
+            if not task.completed and claim_registry.is_claimable(task.task_id, self.agent_id)  # 완료되지 않고 다른 에이전트가 claim하지 않은 작업만 포함
         ]
         
         # 거리가 짧은 순서대로 정렬
@@ -460,20 +525,19 @@ class Agent:
 
         # 에이전트별로 완료되지 않은 작업과의 거리 출력
         if tasks_with_distances:
-            print(f"\nAgent {self.agent_id} - Distances to tasks:")
-            for task, distance in tasks_with_distances:
-                print(f"  Task ID {task.task_id}, Color: {task.color}, Distance: {distance:.2f}")
+            if trace.debug_enabled:
+                trace.debug("\nAgent %d - Distances to tasks:", self.agent_id)
+                for task, distance in tasks_with_distances:
+                    trace.debug("  Task ID %d, Color: %s, Distance: %.2f", task.task_id, task.color, distance)
             
             # 가장 가까운 작업 할당
             nearest_task, min_distance = tasks_with_distances[0]  # 튜플 언패킹을 통해 작업과 거리를 나눠서 저장
-            print(f"Agent {self.agent_id} assigned to Task ID {nearest_task.task_id} (Distance: {min_distance:.2f})")
+            trace.debug("Agent %d assigned to Task ID %d (Distance: %.2f)", self.agent_id, nearest_task.task_id, min_distance)
             self.set_assigned_task_id(nearest_task.task_id)
             self.planned_tasks = [nearest_task]  # 시각화를 위해 planned_tasks에 추가
             #self.follow(nearest_task.position)
-            # 작업을 할당된 상태로 표시
-            nearest_task.assigned = True
         else:
-            print(f"Agent {self.agent_id} - No available tasks to assign.")
+            trace.debug("Agent %d - No available tasks to assign.", self.agent_id)
             
     def update_task_amount_done(self, amount):
         self.task_amount_done += amount
@@ -485,7 +549,7 @@ class Agent:
         - TO_TASK: 작업 위치로 이동 중
         - IDLE: 대기 중
         """
-        if self.blackboard.get('loading', False):
+        if self.blackboard.loading:
             return "TO_DESTINATION"
         elif self.assigned_task_id is not None:
             return "TO_TASK"
@@ -567,7 +631,7 @@ class Agent:
         self.applyForce(steer)
 
         # 디버깅 메시지
-        print(f"[DEBUG] Agent {self.agent_id} moving to {target_pos}. Current position: {current_pos}")
+        trace.debug("Agent %d moving to %s. Current position: %s", self.agent_id, target_pos, current_pos)
 
 
     async def move_to_task_position_action(self, agent, blackboard):
@@ -583,12 +647,16 @@ class Agent:
         # 목표 위치에 도달했는지 확인
         distance_to_initial = agent.position.distance_to(initial_task_position)
         if distance_to_initial < agent_approaching_to_target_radius:
-            print(f"Agent {agent.agent_id} reached the initial task position.")
+            trace.debug("Agent %d reached the initial task position.", agent.agent_id)
             return Status.SUCCESS
 
         return Status.RUNNING
 
 
+if bt_profiler.enabled:
+    bt_profiler.instrument_lazy_sensing(Agent, Blackboard) # The deferred sensing gets its own profile entry
+
+
 def generate_agents(tasks_info):
     agent_quantity = config['agents']['quantity']
     agent_locations = config['agents']['locations']
@@ -603,6 +671,9 @@ def generate_agents(tasks_info):
     # Initialize agents
     agents = [Agent(idx, pos, tasks_info) for idx, pos in enumerate(agents_positions)]
 
+    # Share the per-tick agent x task cost matrix
+    cost_matrix.bind(agents, tasks_info)
+
     # Provide the global info and create behavior tree
     for agent in agents:
         agent.set_global_info_agents(agents)
@@ -0,0 +1,55 @@
+import numpy as np
+from modules.cost_matrix import cost_matrix
+
+# Array-backed inputs for batch decision-making
+class AgentViews:
+    """
+    View of all agents passed to a plugin's class-level `decide_batch(agent_views, blackboards)`.
+    - `positions`: (A, 2) array of agent positions
+    - `active`: (A,) bool array; False for agents that are not deciding in this tick (e.g., carrying a task)
+    - `local_task_mask`: (A, T) bool array of live tasks within each agent's situation awareness radius
+    - `distances`: (A, T) agent x task distance matrix; columns map to `task_list`
+    - `messages_received`: list of each agent's received messages (gathered on first access, which runs the agents' pending communication phase)
+    - `decision_makers`: list of each agent's plugin instance (for per-agent state)
+    """
+    def __init__(self, agents, blackboards):
+        self.agents = agents
+        self.agent_ids = np.arange(len(agents))
+        self.positions = np.array([(agent.position.x, agent.position.y) for agent in agents], dtype=float).reshape(-1, 2)
+        self.active = np.array([not blackboard.loading for blackboard in blackboards], dtype=bool)
+        self.cost_matrix = cost_matrix
+        self.distances = cost_matrix.get_distance_matrix()
+        self.local_task_mask = cost_matrix.get_local_task_mask()
+        self.task_list = cost_matrix.column_tasks
+        self.decision_makers = [agent.decision_maker for agent in agents]
+        self._messages_received = None
+
+    @property
+    def messages_received(self):
+        if self._messages_received is None:
+            self._messages_received = [agent.messages_received for agent in self.agents]
+        return self._messages_received
+
+    def get_local_task_columns(self, agent_id):
+        return np.flatnonzero(self.local_task_mask[agent_id])
+
+
+class BatchDecisionRunner:
+    """
+    Calls the plugin's `decide_batch()` once per tick for the whole swarm and keeps each agent's result,
+    which `DecisionMakingNode` then uses instead of calling the per-agent `decide()`.
+    """
+    def __init__(self):
+        self.decisions = {} # key: agent_id; value: task_id or None
+
+    def run(self, decision_making_class, agents):
+        blackboards = [agent.blackboard for agent in agents]
+        agent_views = AgentViews(agents, blackboards)
+        task_ids = decision_making_class.decide_batch(agent_views, blackboards)
+        self.decisions = {agent.agent_id: task_id for agent, task_id in zip(agents, task_ids)}
+
+    def get_decision(self, agent_id):
+        return self.decisions.get(agent_id)
+
+
+batch_decision_runner = BatchDecisionRunner()
@@ -1,6 +1,7 @@
 from enum import Enum
 import math
 import random
+import time
 import pygame
 
 # BT Node List
@@ -63,20 +64,139 @@ class Fallback(Node):
                 return status
         return Status.FAILURE
 
+# Per-agent mutable state of an action node (the nodes themselves are shared by all agents)
+class NodeState:
+    __slots__ = ('next_activation_time', 'wake_up_epoch', 'cached_status')
+
+    def __init__(self):
+        # Multi-rate ticking (see `SyncAction.set_rate()`)
+        self.next_activation_time = 0.0
+        self.wake_up_epoch = None
+        self.cached_status = None
+
+def is_wake_up_task(agent, blackboard, task):
+    # A task event concerns the agent if it is about its assigned task or a task within its `situation_awareness_radius`
+    if task.task_id == blackboard.assigned_task_id:
+        return True
+    radius = agent.situation_awareness_radius
+    return radius <= 0 or agent.position.distance_squared_to(task.position) <= radius * radius
+
 # Synchronous action node
 class SyncAction(Node):
     def __init__(self, name, action):
         super().__init__(name)
         self.action = action
+        self.period = 0.0 # sec; 0 means every tick
+        self.state_index = None # Index of the node's state in `agent.node_states` (see `BehaviorTreeTemplate`)
+
+    def create_state(self, agent):
+        return NodeState()
+
+    def set_rate(self, rate):
+        """
+        Run the action at most `rate` times per second of simulation time (e.g., `<DecisionMakingNode rate="0.2"/>`).
+        Between activations the node returns its cached status; a task lifecycle event about the agent's assigned task
+        or one of its local tasks (see `is_wake_up_task()`) wakes it up immediately.
+        """
+        self.period = 1.0 / rate if rate > 0 else 0.0
+
+    @staticmethod
+    def _is_throttled(agent, blackboard, state):
+        if state.cached_status is None or event_bus.simulation_time + 1e-9 >= state.next_activation_time:
+            return False
+        if state.wake_up_epoch != event_bus.wake_up_epoch:
+            if any(is_wake_up_task(agent, blackboard, task) for task in event_bus.get_wake_up_tasks(state.wake_up_epoch)):
+                return False
+            state.wake_up_epoch = event_bus.wake_up_epoch # None of the new events concerns the agent
+        return True
+
+    def on_throttled(self, agent, blackboard):
+        # Called instead of the action between activations
+        pass
 
     async def run(self, agent, blackboard):
-        result = self.action(agent, blackboard)
-        blackboard[self.name] = result
+        return self.tick(agent, blackboard)
+
+    def tick(self, agent, blackboard):
+        if self.period > 0:
+            state = agent.node_states[self.state_index]
+            if self._is_throttled(agent, blackboard, state):
+                self.on_throttled(agent, blackboard)
+                blackboard.node_statuses[self.state_index] = state.cached_status
+                return state.cached_status
+            result = self.action(agent, blackboard)
+            # Recorded after the action so that events published by the action itself do not wake the node up
+            state.wake_up_epoch = event_bus.wake_up_epoch
+            state.next_activation_time = event_bus.simulation_time + self.period
+            state.cached_status = result
+        else:
+            result = self.action(agent, blackboard)
+        blackboard.node_statuses[self.state_index] = result
         return result
 
+# Compiled (synchronous) behavior tree
+class CompiledBehaviorTree:
+    """
+    Synchronous form of a behavior tree that ticks without creating a coroutine per node.
+    - The nodes are flattened in pre-order into `instructions`: (opcode, operand, child instruction indices)
+    - Control instructions hold the precomputed indices of their children; action instructions hold the bound `tick()`
+    - Only trees made of `Sequence`, `Fallback` and `SyncAction` nodes (without an overridden async `run()`) can be compiled;
+      trees with a genuinely asynchronous node keep running through `Node.run()`
+    """
+    SEQUENCE = 0
+    FALLBACK = 1
+    ACTION = 2
+
+    def __init__(self, root):
+        self.instructions = []
+        self._compile(root)
+
+    @staticmethod
+    def is_compilable(node):
+        if type(node).run is Sequence.run or type(node).run is Fallback.run:
+            return all(CompiledBehaviorTree.is_compilable(child) for child in node.children)
+        return isinstance(node, SyncAction) and type(node).run is SyncAction.run
+
+    def _compile(self, node):
+        index = len(self.instructions)
+        self.instructions.append(None) # Placeholder; children follow their parent
+        if isinstance(node, SyncAction):
+            self.instructions[index] = (self.ACTION, node.tick, ())
+        else:
+            opcode = self.SEQUENCE if isinstance(node, Sequence) else self.FALLBACK
+            children = tuple(self._compile(child) for child in node.children)
+            self.instructions[index] = (opcode, node, children)
+        return index
+
+    def tick(self, agent, blackboard):
+        return self._tick(0, agent, blackboard)
+
+    def _tick(self, index, agent, blackboard):
+        opcode, operand, children = self.instructions[index]
+        if opcode == self.ACTION:
+            return operand(agent, blackboard)
+        # Same semantics as `Sequence.run()` and `Fallback.run()`
+        for child in children:
+            status = self._tick(child, agent, blackboard)
+            if status == Status.RUNNING:
+                continue
+            if opcode == self.SEQUENCE and status != Status.SUCCESS:
+                return status
+            if opcode == self.FALLBACK and status != Status.FAILURE:
+                return status
+        return Status.SUCCESS if opcode == self.SEQUENCE else Status.FAILURE
+
 # Load additional configuration and import decision-making class dynamically
 import importlib
 from modules.utils import config
+from modules.events import event_bus, TaskAssigned
+from modules.claims import claim_registry
+from modules.batch import batch_decision_runner
+from modules.profiler import bt_profiler
+from modules.watchdog import decision_watchdog
+from modules.trace import get_tracer
+
+trace = get_tracer('behavior_tree')
 from plugins.my_decision_making_plugin import *
 
 target_arrive_threshold = config['tasks']['threshold_done_by_arrival']
@@ -89,81 +209,142 @@ decision_making_module_path = config['decision_making']['plugin']
 module_path, class_name = decision_making_module_path.rsplit('.', 1)
 decision_making_module = importlib.import_module(module_path)
 decision_making_class = getattr(decision_making_module, class_name)
+delegate_to_plugin = config['decision_making'].get('delegate_to_plugin', False)
+batch_decision_making = delegate_to_plugin and hasattr(decision_making_class, 'decide_batch')
+
+def run_batch_decision_making(agents):
+    """
+    Engine hook called once per tick before the agents' behavior trees run.
+    If the plugin implements the class-level `decide_batch()`, the whole swarm decides in one call.
+    The local sensing of the tick is requested for all agents first, so that the batch reads the same data as `decide()` would.
+    """
+    if batch_decision_making:
+        for agent in agents:
+            agent.blackboard.request_sensing(agent)
+        start_time = time.perf_counter()
+        batch_decision_runner.run(decision_making_class, agents)
+        decision_watchdog.record(time.perf_counter() - start_time)
 
 # Local Sensing node
 class LocalSensingNode(SyncAction):
-    def __init__(self, name, agent):
+    def __init__(self, name):
         super().__init__(name, self._local_sensing)
 
     def _local_sensing(self, agent, blackboard):        
-        blackboard['local_tasks_info'] = agent.get_tasks_nearby(with_completed_task = False)
-        blackboard['local_agents_info'] = agent.local_message_receive()
-        #current_position = agent.position
-        blackboard['current_position'] = agent.position  # 에이전트의 현재 위치를 블랙보드에 저장
-        # 충돌 회피 상태 업데이트
-        blackboard['collision_avoidance'] = any(
-            agent.position.distance_to(other_agent.position) < agent.situation_awareness_radius
-            for other_agent in blackboard['local_agents_info']
-        )
-        if 'loading' not in blackboard:
-            blackboard['loading'] = False
+        # `local_tasks_info`, `local_agents_info` (message receipt) and `collision_avoidance` are computed on first use
+        if not batch_decision_making: # Otherwise requested for the tick by `run_batch_decision_making()`
+            blackboard.request_sensing(agent)
+        blackboard.current_position = agent.position  # 에이전트의 현재 위치를 블랙보드에 저장
 
         return Status.SUCCESS
     
 # Decision-making node
 class DecisionMakingNode(SyncAction):
-    def __init__(self, name, agent):
+    def __init__(self, name):
         super().__init__(name, self._decide)
-        self.decision_maker = decision_making_class(agent)
+
+    def create_state(self, agent):
+        # Each agent has its own instance of the decision-making plugin
+        agent.decision_maker = decision_making_class(agent)
+        return super().create_state(agent)
+
+    def on_throttled(self, agent, blackboard):
+        # The claim on the assigned task must not expire between activations (see `tasks.claim_lease_duration`)
+        if claim_registry.lease_duration > 0:
+            claim_registry.renew(agent.agent_id)
 
     def _decide(self, agent, blackboard):
+        if delegate_to_plugin:
+            return self._decide_by_plugin(agent, blackboard)
+
         # 현재 에이전트의 상태가 loading이 False일 때만 새로운 작업을 찾음
-        if not blackboard.get('loading', False):
-            # 다른 에이전트들의 할당된 작업 ID를 확인하여 중복 방지
-            other_agents_assigned_ids = [
-                other_agent.blackboard.get('assigned_task_id') 
-                for other_agent in agent.agents_info if other_agent != agent
-            ]
-
-            # completed가 False이고 다른 에이전트에 할당되지 않은 작업만 선택
-            uncompleted_tasks = [
-                task for task in agent.tasks_info 
-                if not task.completed and task.task_id not in other_agents_assigned_ids
-            ]
-
-            if not uncompleted_tasks:
+        if not blackboard.loading:
+            # completed가 False이고 다른 에이전트가 claim하지 않은 첫 번째 작업을 claim (중복 방지)
+            assigned_task = next(
+                (task for task in agent.tasks_info
+                 if not task.completed and claim_registry.is_claimable(task.task_id, agent.agent_id) and claim_registry.claim(task.task_id, agent.agent_id)),
+                None
+            )
+
+            if assigned_task is None:
                 #print(f"Agent {agent.agent_id} - No uncompleted tasks available.")
                 return Status.FAILURE
             
-            # 작업 할당 로직 (예시: 가장 첫 번째 미완료된 작업 선택)
-            assigned_task_id = uncompleted_tasks[0].task_id
-            blackboard['assigned_task_id'] = assigned_task_id
+            assigned_task_id = assigned_task.task_id
+            if blackboard.assigned_task_id != assigned_task_id:
+                event_bus.publish(TaskAssigned(assigned_task, agent.agent_id))
+            blackboard.assigned_task_id = assigned_task_id
             #print(f"Agent {agent.agent_id} - Task {assigned_task_id} assigned.")
             return Status.SUCCESS
         else:
-            # 작업을 옮기고 있는 중일 때는 계속 진행
+            # 작업을 옮기고 있는 중일 때는 계속 진행 (claim lease 갱신)
             #print(f"Agent {agent.agent_id} - Currently carrying a task.")
+            claim_registry.renew(agent.agent_id)
+            return Status.RUNNING
+
+    def _decide_by_plugin(self, agent, blackboard):
+        # The plugin selects the task (`decide_batch()` once per tick if implemented; `decide()` per agent otherwise)
+        if blackboard.loading:
+            claim_registry.renew(agent.agent_id)
             return Status.RUNNING
 
+        if batch_decision_making:
+            assigned_task_id = batch_decision_runner.get_decision(agent.agent_id)
+        else:
+            start_time = time.perf_counter()
+            assigned_task_id = agent.decision_maker.decide(blackboard)
+            decision_watchdog.record(time.perf_counter() - start_time, agent.agent_id)
+
+        # A task can only be carried by one agent: the plugin's choice is claimed through the registry
+        if assigned_task_id is not None and not self._claim_task(agent, assigned_task_id):
+            assigned_task_id = None
+        if assigned_task_id is None:
+            claim_registry.release_agent(agent.agent_id) # The task given up (or lost) is left to the others
+
+        if assigned_task_id is not None and blackboard.assigned_task_id != assigned_task_id:
+            event_bus.publish(TaskAssigned(agent.tasks_info[assigned_task_id], agent.agent_id))
+        blackboard.assigned_task_id = assigned_task_id
+        agent.set_assigned_task_id(assigned_task_id)
+        return Status.SUCCESS if assigned_task_id is not None else Status.FAILURE
+
+    @staticmethod
+    def _claim_task(agent, task_id):
+        """
+        Claim the plugin's choice (which releases the agent's previous claim). The plugin's decision (e.g., its consensus)
+        prevails over a claim held by another agent that has not picked the task up yet: the claim is handed over.
+        """
+        if claim_registry.claim(task_id, agent.agent_id):
+            return True
+        owner = claim_registry.owner(task_id)
+        return not agent.tasks_info[task_id].loading and claim_registry.claim(task_id, agent.agent_id, expected_owner=owner)
+
 
 from data import container_positions
 from modules.task import Task 
 
 # Task executing node
+class TaskExecutingState(NodeState):
+    __slots__ = ('generated_tasks',)
+
+    def __init__(self):
+        super().__init__()
+        self.generated_tasks = 1  # 생성된 task 수를 추적
+
 class TaskExecutingNode(SyncAction):
-    def __init__(self, name, agent):
+    def __init__(self, name):
         super().__init__(name, self._execute_task)
-        self.agent = agent
         self.max_tasks = config['tasks']['quantity']  # config에서 최대 task 수 가져오기
-        self.generated_tasks = 1  # 생성된 task 수를 추적
 
-    def _assign_task(self, blackboard):
+    def create_state(self, agent):
+        return TaskExecutingState()
+
+    def _assign_task(self, agent, blackboard):
         # 에이전트가 가장 가까운 작업을 할당받도록 함수를 호출
-        self.agent.assign_nearest_task()
+        agent.assign_nearest_task()
         return Status.SUCCESS
 
     def _execute_task(self, agent, blackboard):   
-        assigned_task_id = blackboard.get('assigned_task_id') 
+        assigned_task_id = blackboard.assigned_task_id 
         
         if assigned_task_id is not None:
             task = agent.tasks_info[assigned_task_id]  # 혹은 다른 방법으로 작업 객체를 가져오기
@@ -171,12 +352,12 @@ class TaskExecutingNode(SyncAction):
             if task:
                 
                 # task.color와 destination 값 출력
-                print(f"Task color: {task.color}")
+                trace.debug("Task color: %s", task.color)
                                 
                 # task.color가 문자열로 저장되어 있다고 가정하고 목적지 설정
                 if task.color in container_positions:
                     destination = container_positions[task.color]
-                    print(f"Destination for task color {task.color}: {destination}")
+                    trace.debug("Destination for task color %s: %s", task.color, destination)
                 else:
                     #print(f"Error: No matching destination for color {task.color}")
                     return Status.FAILURE
@@ -190,27 +371,27 @@ class TaskExecutingNode(SyncAction):
                 
             next_waypoint = agent.tasks_info[assigned_task_id].position
              # 에이전트가 작업 위치로 이동
-            if not blackboard.get('loading', False):
+            if not blackboard.loading:
                 distance = math.sqrt((next_waypoint[0] - agent_position[0])**2 + (next_waypoint[1] - agent_position[1])**2)
                 
                 if distance < agent.tasks_info[assigned_task_id].radius + target_arrive_threshold:
                     # 작업에 도달했을 때, 작업 수집 및 loading 설정
-                    task.pick_up_task()
-                    agent.tasks_info[assigned_task_id].pick_up_task()  # 작업을 픽업함
+                    task.pick_up_task(agent.agent_id)  # 작업을 픽업함
                     agent.task_color = task.color  # 현재 작업 색상 설정
                     agent.update_image()  # 에이전트 이미지 업데이트
-                    blackboard['loading'] = True
+                    blackboard.loading = True
                     
                      # 새로운 task 생성 로직
-                    if self.generated_tasks < self.max_tasks and len(agent.tasks_info) < self.max_tasks:  # 이미 생성된 task 수를 확인
+                    state = agent.node_states[self.state_index]
+                    if state.generated_tasks < self.max_tasks and len(agent.tasks_info) < self.max_tasks:  # 이미 생성된 task 수를 확인
                         initial_position = (300, 570)  # 초기 위치 설정
                         existing_ids = {task.task_id for task in agent.tasks_info}
                         new_task_id = max(existing_ids) + 1 if existing_ids else 0  # 최대 task_id에 +1
 
                         new_task = Task(new_task_id, initial_position)
                         agent.tasks_info.append(new_task)
-                        self.generated_tasks += 1
-                        print(f"New task {new_task.task_id} generated at {initial_position}")
+                        state.generated_tasks += 1
+                        trace.info("New task %d generated at %s", new_task.task_id, initial_position)
 
                     return Status.RUNNING
 
@@ -218,17 +399,16 @@ class TaskExecutingNode(SyncAction):
                 return Status.RUNNING
 
             # 작업을 수집한 후, 목적지로 이동
-            elif blackboard.get('loading', False):
+            elif blackboard.loading:
                 
                 #move_task_to_destination(agent, task)
                 distance_to_dest = math.sqrt((destination[0] - agent_position[0])**2 + (destination[1] - agent_position[1])**2)
                 
                 if distance_to_dest < target_arrive_threshold:
                     agent.planned_destination = []  # Destination 경로 초기화
-                    blackboard['loading'] = False  # 작업 완료 후 플래그를 False로 설정
-                    task.completed = True
+                    blackboard.loading = False  # 작업 완료 후 플래그를 False로 설정
                     agent.reset_movement()
-                    task.complete_task(destination)  # offset 값을 조정하여 위치를 조정  # 목적지 위치에서 작업을 보이게 함
+                    task.complete_task(destination, agent_id=agent.agent_id)  # offset 값을 조정하여 위치를 조정  # 목적지 위치에서 작업을 보이게 함
                     agent.task_color = None  # 작업을 완료했으므로 task 색상 제거
                     agent.update_image()  # 기본 이미지로 복구
                     return Status.SUCCESS
@@ -245,21 +425,31 @@ class TaskExecutingNode(SyncAction):
         return Status.FAILURE
 
 # Exploration node
-class ExplorationNode(SyncAction):
-    def __init__(self, name, agent):
-        super().__init__(name, self._random_explore)
+class ExplorationState(NodeState):
+    __slots__ = ('random_move_time', 'random_waypoint')
+
+    def __init__(self):
+        super().__init__()
         self.random_move_time = float('inf')
         self.random_waypoint = (0, 0)
 
+class ExplorationNode(SyncAction):
+    def __init__(self, name):
+        super().__init__(name, self._random_explore)
+
+    def create_state(self, agent):
+        return ExplorationState()
+
     def _random_explore(self, agent, blackboard):
+        state = agent.node_states[self.state_index]
         # Move towards a random position
-        if self.random_move_time > agent_max_random_movement_duration:
-            self.random_waypoint = self.get_random_position(task_locations['x_min'], task_locations['x_max'], task_locations['y_min'], task_locations['y_max'])
-            self.random_move_time = 0 # Initialisation
+        if state.random_move_time > agent_max_random_movement_duration:
+            state.random_waypoint = self.get_random_position(task_locations['x_min'], task_locations['x_max'], task_locations['y_min'], task_locations['y_max'])
+            state.random_move_time = 0 # Initialisation
         
-        blackboard['random_waypoint'] = self.random_waypoint        
-        self.random_move_time += sampling_time   
-        agent.follow(self.random_waypoint)         
+        blackboard.random_waypoint = state.random_waypoint        
+        state.random_move_time += sampling_time   
+        agent.follow(state.random_waypoint)         
         return Status.RUNNING
         
     def get_random_position(self, x_min, x_max, y_min, y_max):
@@ -270,25 +460,25 @@ class ExplorationNode(SyncAction):
 agent_approaching_to_target_radius = config['agents']['target_approaching_radius']
   
 class MoveToInitialTaskPositionNode(SyncAction):
-    def __init__(self, name, agent):
-        super().__init__(name, agent.move_to_task_position_action)
+    def __init__(self, name):
+        super().__init__(name, self._move_to_initial_task_position)
 
-    async def run(self, agent, blackboard):
+    def _move_to_initial_task_position(self, agent, blackboard):
         # 할당된 작업의 완료 여부 확인
         assigned_task_id = agent.assigned_task_id
         if assigned_task_id is None:
-            print(f"[DEBUG] Agent {agent.agent_id} has no assigned task.")
+            trace.debug("Agent %d has no assigned task.", agent.agent_id)
             return Status.FAILURE
 
         # 작업 정보 확인
         task_info = next((task for task in agent.tasks_info if task.task_id == assigned_task_id), None)
         if task_info is None:
-            print(f"[DEBUG] Task ID {assigned_task_id} not found for Agent {agent.agent_id}.")
+            trace.debug("Task ID %d not found for Agent %d.", assigned_task_id, agent.agent_id)
             return Status.FAILURE
 
         # 작업 완료 여부 확인
         if not task_info.completed:
-            print(f"[DEBUG] Task ID {assigned_task_id} for Agent {agent.agent_id} is not completed.")
+            trace.debug("Task ID %d for Agent %d is not completed.", assigned_task_id, agent.agent_id)
             return Status.FAILURE
 
         # 목표 위치로 이동
@@ -296,12 +486,58 @@ class MoveToInitialTaskPositionNode(SyncAction):
         distance_to_target = agent.position.distance_to(target_position)
 
         # 디버깅 메시지
-        print(f"[DEBUG] Agent {agent.agent_id} moving to initial position. Distance: {distance_to_target}")
+        trace.debug("Agent %d moving to initial position. Distance: %s", agent.agent_id, distance_to_target)
 
         if distance_to_target < agent_approaching_to_target_radius:
-            print(f"[DEBUG] Agent {agent.agent_id} reached initial position.")
+            trace.debug("Agent %d reached initial position.", agent.agent_id)
             return Status.SUCCESS
 
         # 목표 위치로 이동
         agent.move_to_initial_task_position(target_position)
         return Status.RUNNING
+
+
+# Behavior tree template shared by all agents
+class BehaviorTreeTemplate:
+    """
+    Behavior tree parsed once from the XML and shared by all agents.
+    - The nodes (and the compiled tree) are not modified after parsing
+    - Per-agent mutable node state lives in `agent.node_states`: one slotted record per action node, indexed by `node.state_index`
+    """
+    def __init__(self, xml_root):
+        self.action_nodes = []
+        self.node_status_index = {} # key: action node name; value: `state_index` (see `Blackboard`)
+        self.root = self._parse_xml_to_bt(xml_root.find('BehaviorTree'))
+        if bt_profiler.enabled:
+            for node in self.action_nodes:
+                bt_profiler.instrument(node) # Before compiling, so that the compiled tree calls the profiled `tick()`
+        # Synchronous form of the tree; None if the tree has a genuinely asynchronous node
+        self.compiled_tree = CompiledBehaviorTree(self.root) if CompiledBehaviorTree.is_compilable(self.root) else None
+
+    def _parse_xml_to_bt(self, xml_node):
+        node_type = xml_node.tag
+        children = []
+
+        for child in xml_node:
+            children.append(self._parse_xml_to_bt(child))
+
+        if node_type in BehaviorTreeList.CONTROL_NODES:
+            control_class = globals()[node_type]  # Control class should be globally available
+            return control_class(node_type, children=children)
+        elif node_type in BehaviorTreeList.ACTION_NODES:
+            action_class = globals()[node_type]  # Action class should be globally available
+            action_node = action_class(node_type)
+            action_node.state_index = len(self.action_nodes)
+            self.action_nodes.append(action_node)
+            self.node_status_index[node_type] = action_node.state_index
+            rate = xml_node.get('rate') # Tick rate (Hz) of the node; every tick if omitted
+            if rate is not None:
+                action_node.set_rate(float(rate))
+            return action_node
+        elif node_type == "BehaviorTree": # Root
+            return children[0]
+        else:
+            raise ValueError(f"[ERROR] Unknown behavior node type: {node_type}")    
+
+    def create_node_states(self, agent):
+        return [node.create_state(agent) for node in self.action_nodes]
@@ -0,0 +1,118 @@
+_PENDING = object() # Lazy sensing field that has not been computed yet
+
+# Typed per-agent blackboard
+class Blackboard:
+    """
+    Blackboard of an agent's behavior tree.
+    - The engine's well-known keys are slotted attributes (e.g., `blackboard.loading`)
+    - The statuses of the action nodes are kept in `node_statuses`, indexed by `node.state_index`
+    - Any other key (e.g., plugin extras) goes to the `extras` dict
+    - The sensing fields (`local_tasks_info`, `local_agents_info`, `collision_avoidance`) are lazy: computed on first read in a tick
+    Dict-style access (`blackboard['local_tasks_info']`, `blackboard.get(...)`, `key in blackboard`) works for all three,
+    with action node statuses addressed by node name (e.g., `blackboard['DecisionMakingNode']`).
+    A well-known field holding `None` counts as unset (`get()` returns the default; `in` is False).
+    """
+    SENSING_FIELDS = ('local_tasks_info', 'local_agents_info', 'collision_avoidance') # Lazy (see `request_sensing()`)
+    FIELDS = frozenset(SENSING_FIELDS + (
+        'current_position',
+        'loading',
+        'assigned_task_id',
+        'random_waypoint',
+    ))
+
+    __slots__ = (
+        '_local_tasks_info', '_local_agents_info', '_collision_avoidance', 'sensing_agent',
+        'current_position', 'loading', 'assigned_task_id', 'random_waypoint',
+        'node_statuses', 'node_status_index', 'extras'
+    )
+
+    def __init__(self, node_status_index=None):
+        self._local_tasks_info = None
+        self._local_agents_info = None
+        self._collision_avoidance = None
+        self.sensing_agent = None
+        self.current_position = None
+        self.loading = False
+        self.assigned_task_id = None
+        self.random_waypoint = None
+        self.node_status_index = node_status_index or {} # key: action node name; value: index in `node_statuses` (shared)
+        self.node_statuses = [None] * (max(self.node_status_index.values()) + 1 if self.node_status_index else 0)
+        self.extras = {}
+
+    # Lazy sensing fields: computed on the first read after `request_sensing()` and memoized until the next request
+    def request_sensing(self, agent):
+        self.sensing_agent = agent
+        self._local_tasks_info = _PENDING
+        self._local_agents_info = _PENDING
+        self._collision_avoidance = _PENDING
+        agent.request_local_sensing()
+
+    def is_sensing_pending(self, field):
+        return getattr(self, '_' + field) is _PENDING
+
+    @property
+    def local_tasks_info(self):
+        if self._local_tasks_info is _PENDING:
+            self._local_tasks_info = self.sensing_agent.get_tasks_nearby(with_completed_task = False)
+        return self._local_tasks_info
+
+    @local_tasks_info.setter
+    def local_tasks_info(self, value):
+        self._local_tasks_info = value
+
+    @property
+    def local_agents_info(self):
+        if self._local_agents_info is _PENDING:
+            self._local_agents_info = self.sensing_agent.agents_nearby # Receives the neighbors' messages if still pending
+        return self._local_agents_info
+
+    @local_agents_info.setter
+    def local_agents_info(self, value):
+        self._local_agents_info = value
+
+    @property
+    def collision_avoidance(self):
+        if self._collision_avoidance is _PENDING:
+            agent = self.sensing_agent
+            self._collision_avoidance = any(
+                agent.position.distance_to(other_agent.position) < agent.situation_awareness_radius
+                for other_agent in self.local_agents_info
+            )
+        return self._collision_avoidance
+
+    @collision_avoidance.setter
+    def collision_avoidance(self, value):
+        self._collision_avoidance = value
+
+    def reset_node_statuses(self):
+        self.node_statuses[:] = [None] * len(self.node_statuses)
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        index = self.node_status_index.get(key)
+        if index is not None:
+            return self.node_statuses[index]
+        return self.extras[key]
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+            return
+        index = self.node_status_index.get(key)
+        if index is not None:
+            self.node_statuses[index] = value
+        else:
+            self.extras[key] = value
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def __contains__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key) is not None
+        return key in self.node_status_index or key in self.extras
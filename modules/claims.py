@@ -0,0 +1,111 @@
+import threading
+from modules.utils import config
+from modules.events import event_bus, TaskCompleted
+
+claim_lease_duration = config.get('tasks', {}).get('claim_lease_duration', 0) # sec; 0 means that claims never expire
+
+# Shared task claim registry
+class TaskClaimRegistry:
+    """
+    Engine-owned record of which agent claims which task.
+    - O(1) claim, release and lookup (`task_id -> agent_id` and `agent_id -> task_id` maps)
+    - Each agent holds at most one claim: claiming a new task releases the previous one
+    - Lease: a claim that is not renewed within `lease_duration` (simulation time) expires, so abandoned tasks become claimable again
+    - `claim()` is an atomic compare-and-claim, so it stays correct when agents decide concurrently
+    """
+    def __init__(self, lease_duration=0):
+        self.lease_duration = lease_duration
+        self.owners = {} # key: task_id; value: agent_id
+        self.claimed_tasks = {} # key: agent_id; value: task_id
+        self.lease_expiry = {} # key: task_id; value: simulation time at which the claim expires
+        self.simulation_time = 0.0
+        self.lock = threading.Lock()
+
+    def set_simulation_time(self, simulation_time):
+        self.simulation_time = simulation_time
+
+    def _current_owner(self, task_id):
+        agent_id = self.owners.get(task_id)
+        if agent_id is not None and self.lease_duration > 0 and self.lease_expiry[task_id] < self.simulation_time:
+            self._remove(task_id) # Lease expired: the owner abandoned the task
+            return None
+        return agent_id
+
+    def _remove(self, task_id):
+        agent_id = self.owners.pop(task_id)
+        self.lease_expiry.pop(task_id, None)
+        if self.claimed_tasks.get(agent_id) == task_id:
+            del self.claimed_tasks[agent_id]
+
+    def owner(self, task_id):
+        with self.lock:
+            return self._current_owner(task_id)
+
+    def is_claimable(self, task_id, agent_id):
+        owner = self.owner(task_id)
+        return owner is None or owner == agent_id
+
+    def get_claimed_task_id(self, agent_id):
+        with self.lock:
+            task_id = self.claimed_tasks.get(agent_id)
+            if task_id is not None and self._current_owner(task_id) != agent_id:
+                return None
+            return task_id
+
+    def claim(self, task_id, agent_id, expected_owner=None):
+        """
+        Claim `task_id` for `agent_id` if its current owner is `expected_owner` (or `agent_id` itself).
+        Returns True on success; the agent's previous claim (if any) is released.
+        """
+        with self.lock:
+            owner = self._current_owner(task_id)
+            if owner != expected_owner and owner != agent_id:
+                return False
+            previous_task_id = self.claimed_tasks.get(agent_id)
+            if previous_task_id is not None and previous_task_id != task_id and self.owners.get(previous_task_id) == agent_id:
+                self._remove(previous_task_id)
+            if owner is not None and owner != agent_id:
+                self.claimed_tasks.pop(owner, None)
+            self.owners[task_id] = agent_id
+            self.claimed_tasks[agent_id] = task_id
+            self._renew(task_id)
+            return True
+
+    def _renew(self, task_id):
+        if self.lease_duration > 0:
+            self.lease_expiry[task_id] = self.simulation_time + self.lease_duration
+
+    def renew(self, agent_id):
+        """
+        Extend the lease of the agent's claim. Returns False if the agent no longer holds a claim.
+        """
+        with self.lock:
+            task_id = self.claimed_tasks.get(agent_id)
+            if task_id is None or self._current_owner(task_id) != agent_id:
+                return False
+            self._renew(task_id)
+            return True
+
+    def release(self, task_id, agent_id=None):
+        """
+        Release the claim on `task_id` (only if it is held by `agent_id`, when given)
+        """
+        with self.lock:
+            owner = self.owners.get(task_id)
+            if owner is None or (agent_id is not None and owner != agent_id):
+                return False
+            self._remove(task_id)
+            return True
+
+    def release_agent(self, agent_id):
+        with self.lock:
+            task_id = self.claimed_tasks.get(agent_id)
+            if task_id is not None and self.owners.get(task_id) == agent_id:
+                self._remove(task_id)
+
+    def on_task_completed(self, event):
+        self.release(event.task_id)
+
+
+claim_registry = TaskClaimRegistry(lease_duration=claim_lease_duration)
+event_bus.subscribe(TaskCompleted, claim_registry.on_task_completed)
@@ -0,0 +1,127 @@
+import numpy as np
+from modules.events import event_bus, TaskCompleted
+
+# Shared per-tick agent x task cost matrix
+class CostMatrix:
+    """
+    Agent x live-task distance matrix shared by every agent's decision-making plugin.
+    - The engine calls `new_tick()` once per simulation tick; the matrix is (re)built lazily on the first access in that tick
+    - Rows follow `agents` (row = agent_id); columns are the tasks not completed at build time
+    - `local_mask[i, j]` is True if task j is within agent i's `situation_awareness_radius` (0 means global)
+    Agents only move in their own `update()` after their behavior tree has run, so each agent's row is exact for its own decision.
+    """
+    def __init__(self):
+        self.agents = []
+        self.tasks = []
+        self.tick = 0
+        self.built_tick = -1
+        self.column_tasks = []
+        self.task_columns = {} # key: task_id; value: column index
+        self.distances = np.zeros((0, 0))
+        self.local_mask = np.zeros((0, 0), dtype=bool)
+        self.alive = np.zeros(0, dtype=bool)
+
+    def bind(self, agents, tasks):
+        self.agents = agents
+        self.tasks = tasks
+        self.built_tick = -1
+
+    def new_tick(self):
+        self.tick += 1
+
+    def _ensure_built(self):
+        if self.built_tick == self.tick:
+            return
+        self.column_tasks = [task for task in self.tasks if not task.completed]
+        self.task_columns = {task.task_id: col for col, task in enumerate(self.column_tasks)}
+        task_positions = np.array([(task.position.x, task.position.y) for task in self.column_tasks], dtype=float).reshape(-1, 2)
+        agent_positions = np.array([(agent.position.x, agent.position.y) for agent in self.agents], dtype=float).reshape(-1, 2)
+        dx = agent_positions[:, 0, None] - task_positions[None, :, 0]
+        dy = agent_positions[:, 1, None] - task_positions[None, :, 1]
+        squared_distances = dx * dx + dy * dy
+        self.distances = np.sqrt(squared_distances)
+        radii = np.array([agent.situation_awareness_radius for agent in self.agents], dtype=float)
+        self.local_mask = (radii[:, None] <= 0) | (squared_distances <= (radii ** 2)[:, None])
+        self.alive = np.ones(len(self.column_tasks), dtype=bool)
+        self.built_tick = self.tick
+
+    def on_task_completed(self, event):
+        if self.built_tick == self.tick:
+            col = self.task_columns.get(event.task_id)
+            if col is not None:
+                self.alive[col] = False
+
+    def get_distance_matrix(self):
+        self._ensure_built()
+        return self.distances
+
+    def get_local_task_mask(self):
+        """
+        (A, T) bool array of live tasks within each agent's situation awareness radius
+        """
+        self._ensure_built()
+        return self.local_mask & self.alive
+
+    def get_local_columns(self, agent):
+        """
+        Columns of the live tasks within the agent's situation awareness radius
+        """
+        self._ensure_built()
+        return np.flatnonzero(self.local_mask[agent.agent_id] & self.alive)
+
+    def get_local_tasks(self, agent):
+        columns = self.get_local_columns(agent)
+        return [self.column_tasks[col] for col in columns], self.distances[agent.agent_id, columns]
+
+    def get_distance_block(self, agents_info, tasks_info):
+        """
+        Distances between `agents_info` (rows) and `tasks_info` (columns, aligned with the given orders),
+        or None if any of the tasks is not in the matrix (completed or created after it was built)
+        """
+        self._ensure_built()
+        columns = [self.task_columns.get(task.task_id) for task in tasks_info]
+        if None in columns:
+            return None
+        rows = [agent.agent_id for agent in agents_info]
+        return self.distances[np.ix_(rows, columns)]
+
+    def get_distances(self, agent, tasks_info):
+        """
+        Distances from the agent to `tasks_info` (aligned with the given order)
+        """
+        self._ensure_built()
+        row = self.distances[agent.agent_id]
+        columns = [self.task_columns.get(task.task_id) for task in tasks_info]
+        if None not in columns:
+            return row[columns]
+        # Tasks created after the matrix was built in this tick
+        return np.array([row[col] if col is not None else (agent.position - task.position).length() for col, task in zip(columns, tasks_info)], dtype=float)
+
+
+# Vectorized scoring kernels
+def get_task_amounts(tasks_info):
+    return np.fromiter((task.amount for task in tasks_info), dtype=float, count=len(tasks_info))
+
+def time_discounted_reward(distances, amounts, max_speed, work_rate, discount_factor):
+    """
+    LAMBDA**(travel time + working time) * amount
+    """
+    return discount_factor ** (distances / max_speed + amounts / work_rate) * amounts
+
+def amount_minus_cost(distances, amounts, cost_weight_factor):
+    """
+    amount - w_c * distance
+    """
+    return amounts - cost_weight_factor * distances
+
+def coalition_utility(distances, amounts, num_collaborators, cost_weight_factor, social_inhibition_factor):
+    """
+    amount / n - w_c * distance * n**f_s (n: coalition size including the agent)
+    n**f_s is looked up from exact (integer) powers, so the result matches the scalar formula bit for bit
+    """
+    inhibition = np.array([float(n ** social_inhibition_factor) for n in range(int(num_collaborators.max(initial=0)) + 1)])
+    return amounts / num_collaborators - cost_weight_factor * distances * inhibition[num_collaborators]
+
+
+cost_matrix = CostMatrix()
+event_bus.subscribe(TaskCompleted, cost_matrix.on_task_completed)
@@ -0,0 +1,122 @@
+from collections import defaultdict
+
+# Task lifecycle events
+class TaskEvent:
+    __slots__ = ('task', 'agent_id')
+    wakes_up_nodes = True # Wakes up throttled behavior tree nodes (see `SyncAction.set_rate()`)
+
+    def __init__(self, task, agent_id=None):
+        self.task = task
+        self.agent_id = agent_id
+
+    @property
+    def task_id(self):
+        return self.task.task_id
+
+    def __repr__(self):
+        return f"{type(self).__name__}(task_id={self.task_id}, agent_id={self.agent_id})"
+
+class TaskCreated(TaskEvent):
+    __slots__ = ()
+
+class TaskAssigned(TaskEvent):
+    __slots__ = ()
+    wakes_up_nodes = False # Published by the deciding node itself
+
+class TaskPickedUp(TaskEvent):
+    __slots__ = ()
+
+class TaskCompleted(TaskEvent):
+    __slots__ = ()
+
+
+# Lightweight in-process publish/subscribe bus
+class EventBus:
+    """
+    Synchronous event bus: `publish()` calls the handlers subscribed to the event type immediately.
+    - `subscribe(event_type, handler)`: called for every event of that type
+    - `subscribe(event_type, handler, task_id=...)`: called only for events of that task (O(1) dispatch)
+    """
+    def __init__(self):
+        self.subscribers = defaultdict(list) # key: event type; value: list of handlers
+        self.task_subscribers = defaultdict(list) # key: (event type, task_id); value: list of handlers
+        self.simulation_time = 0.0
+        self.event_log = None # List of (simulation_time, event) if the event log is enabled
+        self.wake_up_epoch = 0 # Incremented by every event that may wake up throttled behavior tree nodes
+        self.wake_up_tasks = [] # The task of each such event, in order (`wake_up_tasks[epoch]`)
+
+    def subscribe(self, event_type, handler, task_id=None):
+        if task_id is None:
+            self.subscribers[event_type].append(handler)
+        else:
+            self.task_subscribers[(event_type, task_id)].append(handler)
+
+    def unsubscribe(self, event_type, handler, task_id=None):
+        handlers = self.subscribers[event_type] if task_id is None else self.task_subscribers[(event_type, task_id)]
+        if handler in handlers:
+            handlers.remove(handler)
+        if task_id is not None and not handlers:
+            del self.task_subscribers[(event_type, task_id)]
+
+    def publish(self, event):
+        event_type = type(event)
+        if self.event_log is not None:
+            self.event_log.append((self.simulation_time, event))
+        if event.wakes_up_nodes:
+            self.wake_up_tasks.append(event.task)
+            self.wake_up_epoch += 1
+        # Iterate over copies so that handlers may (un)subscribe while being called
+        for handler in tuple(self.subscribers.get(event_type, ())):
+            handler(event)
+        for handler in tuple(self.task_subscribers.get((event_type, event.task_id), ())):
+            handler(event)
+
+    def get_wake_up_tasks(self, since_epoch):
+        # Tasks of the waking events published since `since_epoch` (each node decides whether they concern its agent)
+        return self.wake_up_tasks[since_epoch:]
+
+    def set_simulation_time(self, simulation_time):
+        self.simulation_time = simulation_time
+
+    def enable_event_log(self):
+        if self.event_log is None:
+            self.event_log = []
+
+    def get_event_log_records(self):
+        """
+        Event log as rows of (time, event, task_id, agent_id)
+        """
+        return [
+            (time, type(event).__name__, event.task_id, '' if event.agent_id is None else event.agent_id)
+            for time, event in (self.event_log or [])
+        ]
+
+
+event_bus = EventBus()
+
+
+# Completion of a plugin's assigned task, tracked by `TaskCompleted` instead of polling `task.completed`
+class TaskCompletionWatch:
+    """
+    `watch(task)` subscribes to the completion of `task` (and drops the previous one); `completed` turns True when it is done.
+    Plugins keep `assigned_task` in a watch, e.g. `if self.assigned_task_watch.completed: self.assigned_task = None`.
+    """
+    __slots__ = ('task', 'completed')
+
+    def __init__(self):
+        self.task = None
+        self.completed = False
+
+    def watch(self, task):
+        if task is self.task:
+            return
+        if self.task is not None and not self.completed:
+            event_bus.unsubscribe(TaskCompleted, self.on_task_completed, task_id=self.task.task_id)
+        self.task = task
+        self.completed = task is not None and task.completed # Already done when assigned: no event will follow
+        if task is not None and not self.completed:
+            event_bus.subscribe(TaskCompleted, self.on_task_completed, task_id=task.task_id)
+
+    def on_task_completed(self, event):
+        self.completed = True
+        event_bus.unsubscribe(TaskCompleted, self.on_task_completed, task_id=event.task_id)
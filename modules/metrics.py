@@ -0,0 +1,92 @@
+import pickle
+from collections import Counter
+from modules.utils import config
+
+message_traffic_metrics = config.get('simulation', {}).get('message_traffic_metrics', False)
+
+# Message traffic accounting
+class MessageTrafficMonitor:
+    """
+    Records the communication cost of the messaging path (`Agent.local_message_receive()`).
+    - Per tick: number of delivered messages, delivered bytes and the fan-out (receivers per sender)
+    - Per agent: cumulative messages/bytes sent and received
+    Message sizes are measured as the length of the pickled `message_to_share`, and cached per `message_version`.
+    """
+    TIMEWISE_LABELS = ['messages_delivered', 'message_bytes_delivered', 'mean_message_bytes', 'mean_fanout', 'max_fanout']
+    AGENTWISE_LABELS = ['messages_sent', 'message_bytes_sent', 'messages_received', 'message_bytes_received']
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.message_size_cache = {} # key: sender agent_id; value: (message_version, message size in bytes)
+        self.messages_sent = Counter() # key: agent_id
+        self.message_bytes_sent = Counter()
+        self.messages_received = Counter()
+        self.message_bytes_received = Counter()
+        self.fanout_histogram = Counter() # key: fan-out; value: the number of (sender, tick) pairs
+        self.total_messages_delivered = 0
+        self.total_message_bytes_delivered = 0
+        self._reset_tick()
+
+    def _reset_tick(self):
+        self.tick_messages_delivered = 0
+        self.tick_message_bytes_delivered = 0
+        self.tick_fanout = Counter() # key: sender agent_id; value: the number of receivers in this tick
+
+    def get_message_size(self, sender):
+        cached = self.message_size_cache.get(sender.agent_id)
+        if cached is not None and cached[0] == sender.message_version:
+            return cached[1]
+        try:
+            size = len(pickle.dumps(sender.message_to_share, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception: # Unpicklable contents (e.g., pygame objects); fall back to the text length
+            size = len(repr(sender.message_to_share))
+        self.message_size_cache[sender.agent_id] = (sender.message_version, size)
+        return size
+
+    def record_delivery(self, sender, receiver):
+        size = self.get_message_size(sender)
+        self.tick_messages_delivered += 1
+        self.tick_message_bytes_delivered += size
+        self.tick_fanout[sender.agent_id] += 1
+        self.messages_sent[sender.agent_id] += 1
+        self.message_bytes_sent[sender.agent_id] += size
+        self.messages_received[receiver.agent_id] += 1
+        self.message_bytes_received[receiver.agent_id] += size
+
+    def end_tick(self):
+        """
+        Close the current tick and return its record in the order of `TIMEWISE_LABELS`
+        """
+        fanouts = self.tick_fanout.values()
+        self.fanout_histogram.update(fanouts)
+        mean_fanout = sum(fanouts) / len(fanouts) if fanouts else 0.0
+        max_fanout = max(fanouts) if fanouts else 0
+        mean_message_bytes = self.tick_message_bytes_delivered / self.tick_messages_delivered if self.tick_messages_delivered else 0.0
+        record = [
+            self.tick_messages_delivered,
+            self.tick_message_bytes_delivered,
+            mean_message_bytes,
+            mean_fanout,
+            max_fanout
+        ]
+        self.total_messages_delivered += self.tick_messages_delivered
+        self.total_message_bytes_delivered += self.tick_message_bytes_delivered
+        self._reset_tick()
+        return record
+
+    def get_agentwise_record(self, agent_id):
+        """
+        Cumulative traffic of an agent in the order of `AGENTWISE_LABELS`
+        """
+        return (
+            self.messages_sent[agent_id],
+            self.message_bytes_sent[agent_id],
+            self.messages_received[agent_id],
+            self.message_bytes_received[agent_id]
+        )
+
+    def get_fanout_distribution(self):
+        return sorted(self.fanout_histogram.items())
+
+
+message_traffic_monitor = MessageTrafficMonitor(enabled=message_traffic_metrics)
@@ -0,0 +1,145 @@
+import json
+import time
+from modules.utils import config
+
+bt_profiling = config.get('simulation', {}).get('bt_profiling', False)
+bt_profiling_per_agent = config.get('simulation', {}).get('bt_profiling_per_agent', False)
+
+# Statistics of one behavior tree node (per node type, or per node type and agent)
+class NodeProfile:
+    __slots__ = ('calls', 'total_time', 'max_time', 'success', 'failure', 'running')
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.success = 0
+        self.failure = 0
+        self.running = 0
+
+    def record(self, status_name, elapsed):
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if status_name == 'SUCCESS':
+            self.success += 1
+        elif status_name == 'FAILURE':
+            self.failure += 1
+        elif status_name == 'RUNNING':
+            self.running += 1
+
+    def get_record(self):
+        calls = self.calls or 1
+        return [
+            self.calls,
+            self.total_time,
+            self.total_time / calls,
+            self.max_time,
+            self.success / calls,
+            self.failure / calls,
+            self.running / calls
+        ]
+
+
+# Behavior tree node profiler
+class BehaviorTreeProfiler:
+    """
+    Records per-node call counts, cumulative/max wall time and SUCCESS/FAILURE/RUNNING ratios of the action nodes.
+    - Aggregated per node type, and optionally per (node type, agent)
+    - Only instrumented when enabled (`instrument()` wraps the nodes' `tick()` at template creation), so it costs nothing otherwise
+    - The deferred sensing (see `Blackboard.request_sensing()`) is recorded under its own entry (`LAZY_SENSING`),
+      and not charged to the node that happens to read it first
+    """
+    LABELS = ['node', 'agent_id', 'calls', 'total_time', 'mean_time', 'max_time', 'success_ratio', 'failure_ratio', 'running_ratio']
+    LAZY_SENSING = 'LocalSensing (lazy)'
+
+    def __init__(self, enabled=False, per_agent=False):
+        self.enabled = enabled
+        self.per_agent = per_agent
+        self.node_profiles = {} # key: node name; value: NodeProfile
+        self.agent_node_profiles = {} # key: (node name, agent_id); value: NodeProfile
+        self.lazy_sensing_time = 0.0 # Cumulative time of the deferred sensing, excluded from the nodes that triggered it
+        self.lazy_sensing_depth = 0 # Nesting of the timed deferred sensing (see `instrument_lazy_sensing()`)
+
+    def instrument(self, node):
+        """
+        Wrap `node.tick()` with timing (the wrapper shadows the method on the node instance)
+        """
+        tick = node.tick
+        profile = self.node_profiles.setdefault(node.name, NodeProfile())
+        agent_node_profiles = self.agent_node_profiles if self.per_agent else None
+        perf_counter = time.perf_counter
+
+        def profiled_tick(agent, blackboard):
+            lazy_sensing_time = self.lazy_sensing_time
+            start = perf_counter()
+            status = tick(agent, blackboard)
+            elapsed = perf_counter() - start - (self.lazy_sensing_time - lazy_sensing_time)
+            self.record(node.name, profile, agent_node_profiles, agent, getattr(status, 'name', None), elapsed)
+            return status
+
+        node.tick = profiled_tick
+
+    def instrument_lazy_sensing(self, agent_class, blackboard_class):
+        """
+        Wrap the deferred sensing with timing: the pending communication phase of `agent_class` (`_flush_local_sensing()`)
+        and the pending sensing fields of `blackboard_class` (`SENSING_FIELDS`).
+        Other calls of the agent's sensing methods (e.g., `get_tasks_nearby()` in a plugin's `decide()`) stay charged to their node.
+        """
+        profile = self.node_profiles.setdefault(self.LAZY_SENSING, NodeProfile())
+        agent_node_profiles = self.agent_node_profiles if self.per_agent else None
+        perf_counter = time.perf_counter
+
+        def timed(method, is_pending, get_agent):
+            def timed_method(owner, *args, **kwargs):
+                # Only the outermost pending sensing is timed (a sensing field may flush the communication phase)
+                if self.lazy_sensing_depth > 0 or not is_pending(owner):
+                    return method(owner, *args, **kwargs)
+                self.lazy_sensing_depth += 1
+                start = perf_counter()
+                try:
+                    return method(owner, *args, **kwargs)
+                finally:
+                    elapsed = perf_counter() - start
+                    self.lazy_sensing_depth -= 1
+                    self.lazy_sensing_time += elapsed
+                    self.record(self.LAZY_SENSING, profile, agent_node_profiles, get_agent(owner), None, elapsed)
+            return timed_method
+
+        agent_class._flush_local_sensing = timed(agent_class._flush_local_sensing, lambda agent: agent.local_sensing_pending, lambda agent: agent)
+        for field in blackboard_class.SENSING_FIELDS:
+            field_property = getattr(blackboard_class, field)
+            getter = timed(field_property.fget, lambda blackboard, field=field: blackboard.is_sensing_pending(field), lambda blackboard: blackboard.sensing_agent)
+            setattr(blackboard_class, field, property(getter, field_property.fset))
+
+    @staticmethod
+    def record(name, profile, agent_node_profiles, agent, status_name, elapsed):
+        profile.record(status_name, elapsed)
+        if agent_node_profiles is not None:
+            key = (name, agent.agent_id)
+            agent_profile = agent_node_profiles.get(key)
+            if agent_profile is None:
+                agent_profile = agent_node_profiles[key] = NodeProfile()
+            agent_profile.record(status_name, elapsed)
+
+    def get_records(self):
+        """
+        Rows in the order of `LABELS`; `agent_id` is '' for the aggregate over all agents
+        """
+        records = [[name, ''] + profile.get_record() for name, profile in self.node_profiles.items()]
+        records += [[name, agent_id] + profile.get_record() for (name, agent_id), profile in sorted(self.agent_node_profiles.items())]
+        return records
+
+    def save_json(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump([dict(zip(self.LABELS, record)) for record in self.get_records()], f, indent=2)
+
+    def print_summary(self):
+        total_time = sum(profile.total_time for profile in self.node_profiles.values()) or 1.0
+        print("Behavior tree node profile (all agents):")
+        for name, profile in sorted(self.node_profiles.items(), key=lambda item: -item[1].total_time):
+            print(f"  {name}: {profile.calls} calls, {profile.total_time:.4f} s ({100.0 * profile.total_time / total_time:.1f}%), max {1000.0 * profile.max_time:.3f} ms")
+
+
+bt_profiler = BehaviorTreeProfiler(enabled=bt_profiling, per_agent=bt_profiling_per_agent)
@@ -1,6 +1,7 @@
 import pygame
 import random
 from modules.utils import config, generate_positions, generate_task_colors
+from modules.events import event_bus, TaskCreated, TaskPickedUp, TaskCompleted
 import asyncio
 
 task_colors = generate_task_colors(1)  # 단일 task 생성
@@ -16,23 +17,24 @@ class Task:
         self.amount = random.uniform(config['tasks']['amounts']['min'], config['tasks']['amounts']['max'])
         self.radius = self.amount / config['simulation']['task_visualisation_factor']
         self.completed = False
-        self.assigned = False
 
         #랜덤 이미지 설정
         self.color = color if color else random.choice(list(task_images.keys()))  # color가 주어지지 않으면 랜덤 선택
         self.image = task_images[self.color]  # 선택된 color에 해당하는 이미지 할당
         self.loading = False
+        event_bus.publish(TaskCreated(self))
 
-    def pick_up_task(self):
+    def pick_up_task(self, agent_id=None):
         """작업을 숨기는 메서드"""
         self.loading = True  # 작업이 보이지 않도록 설정
+        event_bus.publish(TaskPickedUp(self, agent_id))
         #print(f"Task {self.task_id} is now picked up.")
 
-    def complete_task(self, new_position, offset=(0,0)):
+    def complete_task(self, new_position, offset=(0,0), agent_id=None):
         """작업을 새로운 위치에서 다시 나타나게 하는 메서드"""
         self.position = pygame.Vector2(new_position[0] + offset[0], new_position[1] + offset[1])  # 위치 조정
         self.loading = False  # 작업을 다시 보이게 설정
-        self.completed = True  # 작업이 완료되었음을 표시
+        self.set_done(agent_id)  # 작업이 완료되었음을 표시
 
         # 작업 완료 시 Containers/png 경로의 이미지로 변경
         container_images = {
@@ -47,13 +49,16 @@ class Task:
         self.image = pygame.transform.scale(container_images[self.color], (container_width, container_height))
 
 
-    def set_done(self):
+    def set_done(self, agent_id=None):
+        if self.completed:
+            return
         self.completed = True
+        event_bus.publish(TaskCompleted(self, agent_id))
 
-    def reduce_amount(self, work_rate):
+    def reduce_amount(self, work_rate, agent_id=None):
         self.amount -= work_rate * sampling_time
         if self.amount <= 0:
-            self.set_done()
+            self.set_done(agent_id)
 
     def draw(self, screen):
         #self.radius = self.amount / config['simulation']['task_visualisation_factor']        
@@ -0,0 +1,88 @@
+from collections import deque
+from modules.utils import config
+from modules.events import event_bus
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'OFF': 100}
+LEVEL_NAMES = {value: key for key, value in LEVELS.items()}
+DEBUG = LEVELS['DEBUG']
+INFO = LEVELS['INFO']
+WARNING = LEVELS['WARNING']
+ERROR = LEVELS['ERROR']
+
+trace_config = config.get('simulation', {}).get('trace', {}) or {}
+trace_level = LEVELS[trace_config.get('level', 'WARNING')]
+trace_subsystem_levels = {subsystem: LEVELS[level] for subsystem, level in (trace_config.get('subsystem_levels', {}) or {}).items()}
+trace_ring_buffer_size = trace_config.get('ring_buffer_size', 0) # 0 means no ring buffer
+trace_ring_buffer_level = LEVELS[trace_config.get('ring_buffer_level', 'DEBUG')]
+
+# In-memory sink of the most recent trace records (unformatted), dumped on error
+class TraceRingBuffer:
+    def __init__(self, size):
+        self.records = deque(maxlen=size) # (simulation_time, level, subsystem, message, args)
+
+    def append(self, record):
+        self.records.append(record)
+
+    def dump(self, file_path):
+        with open(file_path, 'w') as f:
+            for simulation_time, level, subsystem, message, args in self.records:
+                f.write(f"[{simulation_time:.2f}] {LEVEL_NAMES[level]} {subsystem}: {format_message(message, args)}\n")
+        print(f"Dumped {len(self.records)} trace records to: {file_path}")
+
+def format_message(message, args):
+    return message % args if args else message
+
+
+# Per-subsystem tracer
+class Tracer:
+    """
+    Leveled trace output of a subsystem (e.g., `agent`, `behavior_tree`).
+    - Messages use %-style arguments, e.g. `trace.debug("Agent %d - Task %d", agent_id, task_id)`,
+      and are only formatted when printed (the ring buffer keeps them unformatted)
+    - `debug_enabled`/`info_enabled` can guard loops that only produce trace output
+    """
+    def __init__(self, subsystem, level=WARNING, ring_buffer=None, ring_buffer_level=DEBUG):
+        self.subsystem = subsystem
+        self.level = level
+        self.ring_buffer = ring_buffer
+        self.ring_buffer_level = ring_buffer_level if ring_buffer is not None else LEVELS['OFF']
+        self.threshold = min(self.level, self.ring_buffer_level)
+        self.debug_enabled = self.threshold <= DEBUG
+        self.info_enabled = self.threshold <= INFO
+
+    def log(self, level, message, *args):
+        if level < self.threshold:
+            return
+        if level >= self.ring_buffer_level:
+            self.ring_buffer.append((event_bus.simulation_time, level, self.subsystem, message, args))
+        if level >= self.level:
+            print(format_message(message, args))
+
+    def debug(self, message, *args):
+        if self.debug_enabled:
+            self.log(DEBUG, message, *args)
+
+    def info(self, message, *args):
+        if self.info_enabled:
+            self.log(INFO, message, *args)
+
+    def warning(self, message, *args):
+        self.log(WARNING, message, *args)
+
+    def error(self, message, *args):
+        self.log(ERROR, message, *args)
+
+
+trace_ring_buffer = TraceRingBuffer(trace_ring_buffer_size) if trace_ring_buffer_size > 0 else None
+tracers = {} # key: subsystem
+
+def get_tracer(subsystem):
+    tracer = tracers.get(subsystem)
+    if tracer is None:
+        tracer = tracers[subsystem] = Tracer(
+            subsystem,
+            level=trace_subsystem_levels.get(subsystem, trace_level),
+            ring_buffer=trace_ring_buffer,
+            ring_buffer_level=trace_ring_buffer_level
+        )
+    return tracer
@@ -117,6 +117,11 @@ class ResultSaver:
 
 
 
+    def get_result_file_path(self, additional_keyword, extension):
+        # Same timestamped base name as the other results, e.g. `..._2024-08-20_17-26-49_{additional_keyword}.{extension}`
+        base, _ = os.path.splitext(self.result_file_path)
+        return f"{base}_{additional_keyword}.{extension}"
+
     def save_gif(self, frames):
         if frames:                  
             gif_recording_fps = config['simulation']['gif_recording_fps']
@@ -142,7 +147,7 @@ class ResultSaver:
     def save_to_csv(self, type, data_records, data_labels):
         """
         save list to csv
-        - type: "agentwise" or "timewise" or None
+        - type: "agentwise" or "timewise" or any other keyword appended to the file name (e.g. "fanout") or None
         - data
         - label        
         """
@@ -155,6 +160,8 @@ class ResultSaver:
         elif type == "timewise":
             csv_file_path = self.change_file_extension(self.timewise_result_file_path, "csv")
             self.df_agentwise_result = df
+        elif type is not None:
+            csv_file_path = self.get_result_file_path(type, "csv")
         else:
             csv_file_path = self.change_file_extension(self.result_file_path, "csv")
         
@@ -0,0 +1,83 @@
+from collections import deque
+import numpy as np
+from modules.utils import config
+
+decide_time_budget = config['decision_making'].get('decide_time_budget', 0) # sec per `decide()` call; 0 means no budget
+decide_tick_budget = config['decision_making'].get('decide_tick_budget', 0) # sec of all `decide()` calls in a tick; 0 means no budget
+abort_on_budget_exceeded = config['decision_making'].get('abort_on_budget_exceeded', False)
+
+# Compute-budget watchdog of the decision-making plugin
+class DecisionWatchdog:
+    """
+    Times every `decide()` (or `decide_batch()`) call of the plugin.
+    - Rolling p50/p99/max over the last `window` calls, plus the all-time max
+    - Warns when a call exceeds `time_budget` or the calls of one tick exceed `tick_budget` (wall time, sec)
+    - With `abort`, the first violation sets `abort_requested` and the run ends with the status `budget_exceeded`
+    """
+    MAX_WARNINGS = 10 # Further warnings are only counted
+    LABELS = ['plugin', 'status', 'calls', 'total_time', 'p50_time', 'p99_time', 'max_time', 'calls_over_budget', 'ticks_over_budget']
+
+    def __init__(self, plugin_name, time_budget=0, tick_budget=0, abort=False, window=1000):
+        self.plugin_name = plugin_name
+        self.time_budget = time_budget
+        self.tick_budget = tick_budget
+        self.abort = abort
+        self.recent_times = deque(maxlen=window)
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.tick_time = 0.0
+        self.calls_over_budget = 0
+        self.ticks_over_budget = 0
+        self.warnings = 0
+        self.status = 'ok'
+        self.abort_requested = False
+
+    def record(self, elapsed, agent_id=None):
+        self.recent_times.append(elapsed)
+        self.calls += 1
+        self.total_time += elapsed
+        self.tick_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if self.time_budget > 0 and elapsed > self.time_budget:
+            self.calls_over_budget += 1
+            self._exceeded(f"{self.plugin_name}.decide() of agent {agent_id} took {1000.0 * elapsed:.2f} ms (budget: {1000.0 * self.time_budget:.2f} ms)")
+
+    def end_tick(self, simulation_time=None):
+        if self.tick_budget > 0 and self.tick_time > self.tick_budget:
+            self.ticks_over_budget += 1
+            self._exceeded(f"{self.plugin_name} decisions took {1000.0 * self.tick_time:.2f} ms in the tick at t={simulation_time} (budget: {1000.0 * self.tick_budget:.2f} ms)")
+        self.tick_time = 0.0
+
+    def _exceeded(self, message):
+        if self.warnings < self.MAX_WARNINGS:
+            print(f"[WARNING] {message}")
+            if self.warnings == self.MAX_WARNINGS - 1:
+                print("[WARNING] Further decision budget warnings are suppressed")
+        self.warnings += 1
+        if self.abort:
+            self.status = 'budget_exceeded'
+            self.abort_requested = True
+
+    def get_percentiles(self):
+        """
+        Rolling (p50, p99, max) of the recent calls
+        """
+        if not self.recent_times:
+            return 0.0, 0.0, 0.0
+        times = np.fromiter(self.recent_times, dtype=float, count=len(self.recent_times))
+        p50, p99 = np.percentile(times, [50, 99])
+        return float(p50), float(p99), float(times.max())
+
+    def get_record(self):
+        p50, p99, _ = self.get_percentiles()
+        return [self.plugin_name, self.status, self.calls, self.total_time, p50, p99, self.max_time, self.calls_over_budget, self.ticks_over_budget]
+
+
+decision_watchdog = DecisionWatchdog(
+    config['decision_making']['plugin'].rsplit('.', 1)[-1],
+    time_budget=decide_time_budget,
+    tick_budget=decide_tick_budget,
+    abort=abort_on_budget_exceeded
+)
@@ -0,0 +1,355 @@
+import math
+import numpy as np
+from modules.utils import config
+from modules.events import event_bus, TaskCreated, TaskCompleted, TaskCompletionWatch
+from modules.cost_matrix import cost_matrix, get_task_amounts, time_discounted_reward
+
+AUCTION_CONFIG = config['decision_making'].get('Auction', {}) or {} # Optional, so that the reference solver can be imported with any plugin
+LAMBDA = AUCTION_CONFIG.get('task_reward_discount_factor', 0.999)
+EPSILON_INITIAL = AUCTION_CONFIG.get('epsilon_initial', 5.0)
+EPSILON_FINAL = AUCTION_CONFIG.get('epsilon_final', 0.01)
+EPSILON_SCALING_FACTOR = AUCTION_CONFIG.get('epsilon_scaling_factor', 5.0)
+EPSILON_PHASE_ROUNDS = AUCTION_CONFIG.get('epsilon_phase_rounds', 5) # Communication rounds (decisions) per epsilon
+# The number of times epsilon is divided before it reaches `EPSILON_FINAL` (the schedule stays there afterwards)
+EPSILON_PHASES = math.ceil(math.log(EPSILON_INITIAL / EPSILON_FINAL) / math.log(EPSILON_SCALING_FACTOR)) if EPSILON_INITIAL > EPSILON_FINAL and EPSILON_SCALING_FACTOR > 1 else 0
+EPSILON_FINAL_ROUNDS = EPSILON_PHASES * EPSILON_PHASE_ROUNDS # Rounds until the last phase
+NO_AGENT = -1 # No bidder (in the bidder list) / no task (in an assignment array)
+
+def pad_array(array, size, fill_value):
+    # The price/bidder lists grow as tasks are generated; the new rows hold `fill_value`
+    if len(array) >= size:
+        return array[:size]
+    return np.concatenate((array, np.full(size - len(array), fill_value, dtype=array.dtype)))
+
+def get_writable(array):
+    # The price/bidder lists are shared read-only with the published message, so they are copied before the first change
+    return array if array.flags.writeable else array.copy()
+
+def get_epsilon(rounds):
+    """
+    Epsilon-scaling schedule: `EPSILON_INITIAL` divided by `EPSILON_SCALING_FACTOR` every `EPSILON_PHASE_ROUNDS` rounds, down to `EPSILON_FINAL`
+    """
+    return max(EPSILON_INITIAL / EPSILON_SCALING_FACTOR ** min(rounds // EPSILON_PHASE_ROUNDS, EPSILON_PHASES), EPSILON_FINAL)
+
+def get_benefits(distances, amounts, max_speed, work_rate):
+    # Benefit of an agent doing a task (time-discounted reward, as in CBAA/CBBA)
+    return time_discounted_reward(distances, amounts, max_speed, work_rate, LAMBDA)
+
+def get_best_two_values(values):
+    """
+    The best value (and its column) and the second best value in each row of `values`; -inf if there is none
+    """
+    rows = np.arange(len(values))
+    best_columns = values.argmax(axis=1)
+    best_values = values[rows, best_columns]
+    if values.shape[1] < 2:
+        return best_columns, best_values, np.full(len(values), -np.inf)
+    second_values = np.partition(values, values.shape[1] - 2, axis=1)[:, -2]
+    return best_columns, best_values, second_values
+
+
+# Task set changes (arrivals and completions): an agent restarts its epsilon schedule on its warm-started prices
+# only if one of the changed tasks is among its local tasks
+class TaskSetMonitor:
+    def __init__(self):
+        self.changed_tasks = [] # In order; `version` is the number of changes so far
+
+    @property
+    def version(self):
+        return len(self.changed_tasks)
+
+    def on_task_set_changed(self, event):
+        self.changed_tasks.append(event.task)
+
+    def get_changed_tasks(self, since_version):
+        return self.changed_tasks[since_version:]
+
+
+task_set_monitor = TaskSetMonitor()
+event_bus.subscribe(TaskCreated, task_set_monitor.on_task_set_changed)
+event_bus.subscribe(TaskCompleted, task_set_monitor.on_task_set_changed)
+
+
+# Centralized reference solver (for validation)
+def get_epsilon_phases(epsilon_initial, epsilon_final, scaling_factor):
+    """
+    The epsilons of the scaled phases: `epsilon_initial` divided by `scaling_factor` each phase, ending with `epsilon_final`
+    """
+    epsilon = epsilon_initial
+    while scaling_factor > 1 and epsilon > epsilon_final:
+        yield epsilon
+        epsilon /= scaling_factor
+    yield epsilon_final
+
+def solve_assignment(benefits, epsilon=EPSILON_FINAL, epsilon_initial=EPSILON_INITIAL, scaling_factor=EPSILON_SCALING_FACTOR):
+    """
+    One-to-one assignment maximizing the total benefit by the auction algorithm with epsilon-scaling.
+    - `benefits`: (A, T) array; -inf for pairs that are not allowed (e.g., tasks outside the situation awareness radius)
+    - Every agent may stay unassigned (benefit 0), so A and T are arbitrary
+    - Each phase (`get_epsilon_phases()`, down to `epsilon`) restarts the assignments on the prices of the previous phase (warm start):
+      a forward auction (`forward_auction()`) assigns the agents, then a reverse auction (`reverse_auction()`) settles the tasks
+      that an earlier phase priced but that are left unassigned
+    Returns (task column of each agent or NO_AGENT, task prices). The result is within A * epsilon of the optimum;
+    `get_dual_bound()` gives an upper bound to check it against.
+    """
+    prices = np.zeros(benefits.shape[1])
+    for phase_epsilon in get_epsilon_phases(epsilon_initial, epsilon, scaling_factor):
+        assignment, owners = forward_auction(benefits, prices, phase_epsilon)
+        reverse_auction(benefits, prices, assignment, owners, phase_epsilon)
+    return assignment, prices
+
+def forward_auction(benefits, prices, epsilon):
+    """
+    Jacobi forward auction from `prices` (raised in place): in each iteration, all unassigned agents bid on their best task at once,
+    and the highest bid on each task wins. Returns (task column of each agent or NO_AGENT, agent of each task or NO_AGENT).
+    """
+    num_agents, num_tasks = benefits.shape
+    assignment = np.full(num_agents, NO_AGENT, dtype=np.int64)
+    owners = np.full(num_tasks, NO_AGENT, dtype=np.int64)
+    bidders = np.arange(num_agents) if num_tasks > 0 else np.zeros(0, dtype=np.int64)
+    while len(bidders) > 0:
+        best_columns, best_values, second_values = get_best_two_values(benefits[bidders] - prices)
+        # Staying unassigned is worth 0, so agents whose best value is not positive drop out (prices only increase)
+        bidding = best_values > 0
+        bidders, best_columns = bidders[bidding], best_columns[bidding]
+        bids = prices[best_columns] + best_values[bidding] - np.maximum(second_values[bidding], 0) + epsilon
+        if len(bidders) == 0:
+            break
+
+        # The highest bid on each task wins (sorted by task, then by bid)
+        order = np.lexsort((bids, best_columns))
+        sorted_columns = best_columns[order]
+        is_last = np.append(sorted_columns[1:] != sorted_columns[:-1], True)
+        won_columns = sorted_columns[is_last]
+        winners = bidders[order][is_last]
+
+        outbid = owners[won_columns]
+        outbid = outbid[outbid != NO_AGENT]
+        assignment[outbid] = NO_AGENT
+        owners[won_columns] = winners
+        assignment[winners] = won_columns
+        prices[won_columns] = bids[order][is_last]
+
+        bidders = np.concatenate((bidders[order][~is_last], outbid))
+    return assignment, owners
+
+def reverse_auction(benefits, prices, assignment, owners, epsilon):
+    """
+    Reverse auction (in place) for the tasks left unassigned at a positive price: such a task takes its best agent
+    (benefit - the agent's profit) at the second best offer minus `epsilon`, or drops its price to 0 if no agent gains more than `epsilon`.
+    An agent that moves leaves its previous task, which is settled in turn; the profits of the agents only increase.
+    """
+    num_agents = benefits.shape[0]
+    if num_agents == 0:
+        prices[:] = 0.0
+        return
+    assigned = np.flatnonzero(assignment != NO_AGENT)
+    profits = np.zeros(num_agents)
+    profits[assigned] = benefits[assigned, assignment[assigned]] - prices[assignment[assigned]]
+    pending = list(np.flatnonzero((owners == NO_AGENT) & (prices > 0)))
+    while pending:
+        column = pending.pop()
+        best_rows, best_values, second_values = get_best_two_values((benefits[:, column] - profits)[None, :])
+        if best_values[0] <= epsilon:
+            prices[column] = 0.0
+            continue
+        agent = best_rows[0]
+        prices[column] = max(second_values[0] - epsilon, 0.0)
+        previous_column = assignment[agent]
+        if previous_column != NO_AGENT:
+            owners[previous_column] = NO_AGENT
+            if prices[previous_column] > 0:
+                pending.append(previous_column)
+        assignment[agent] = column
+        owners[column] = agent
+        profits[agent] = benefits[agent, column] - prices[column]
+
+def get_total_benefit(benefits, assignment):
+    assigned = np.flatnonzero(assignment != NO_AGENT)
+    return float(benefits[assigned, assignment[assigned]].sum())
+
+def get_dual_bound(benefits, prices):
+    """
+    Upper bound of the optimal total benefit for any task prices (LP duality): the agents' best values (at least 0) plus the prices
+    """
+    if benefits.shape[1] == 0:
+        return 0.0
+    return float(np.maximum((benefits - prices).max(axis=1), 0).sum() + prices.sum())
+
+
+# Define decision-making class
+class Auction:
+    """
+    Decentralized auction (Bertsekas) over the local communication graph.
+    - Each agent keeps a price list and a bidder list (indexed by task_id) and broadcasts them;
+      received lists are merged by the highest (price, bidder) per task, which all agents agree on once the information has spread
+    - An agent that is not (or no longer) the bidder of its task bids on its best local task: the price rises by
+      the difference between the best and the second best value (benefit - price; 0 for staying unassigned) plus `epsilon`
+    - `epsilon` follows the epsilon-scaling schedule (`get_epsilon()`), restarted when tasks arrive or complete among the agent's
+      local tasks; the prices are kept (warm start), and new tasks start at price 0
+    - Unlike centralized epsilon-scaling, the assignments are not restarted when `epsilon` shrinks (a released task would keep its price,
+      which needs a reverse auction to undo), so the large first bids settle conflicts quickly and the later bids are finer
+    """
+    def __init__(self, agent):
+        self.agent = agent
+        self.assigned_task_watch = TaskCompletionWatch()
+
+        # Dense arrays indexed by task_id, grown as tasks are generated (see `ensure_capacity()`)
+        self.prices = np.zeros(0) # Price list
+        self.bidders = np.full(0, NO_AGENT, dtype=np.int64) # Bidder list (the highest bidder of each task)
+        self.rounds = 0 # Rounds since the epsilon schedule was (re)started
+        self.merged_messages = {} # key: agent_id; value: the last merged message of the agent (merging it again changes nothing)
+        self.task_set_version = task_set_monitor.version
+        self.last_local_tasks_info = [] # The local tasks of the previous decision (a completed task has left `local_tasks_info`)
+
+    @property
+    def assigned_task(self):
+        return self.assigned_task_watch.task
+
+    @assigned_task.setter
+    def assigned_task(self, task):
+        # Subscribes to the task's `TaskCompleted` (see `TaskCompletionWatch`)
+        self.assigned_task_watch.watch(task)
+
+    def decide(self, blackboard):
+        '''
+        Output:
+            - `task_id`, if task allocation works well
+            - `None`, otherwise
+        '''
+        local_tasks_info = blackboard['local_tasks_info']
+        self.ensure_capacity(len(self.agent.tasks_info))
+
+        # Post-process if the previously assigned task is done
+        if self.assigned_task_watch.completed:
+            self.assigned_task = None
+
+        # Warm start: the prices carry over to the changed task set, with a restarted epsilon schedule
+        if self.task_set_version != task_set_monitor.version:
+            if self.is_local_task_set_changed(local_tasks_info):
+                self.rounds = 0
+            self.task_set_version = task_set_monitor.version
+        self.last_local_tasks_info = local_tasks_info
+        epsilon = get_epsilon(self.rounds)
+        if self.rounds < EPSILON_FINAL_ROUNDS: # Not counted further once epsilon is final
+            self.rounds += 1
+
+        changed = self.merge_messages(self.agent.messages_received)
+        self.agent.reset_messages_received()
+
+        # Outbid: the task goes to the other agent
+        if self.assigned_task is not None and self.bidders[self.assigned_task.task_id] != self.agent.agent_id:
+            self.assigned_task = None
+
+        if self.assigned_task is None and len(local_tasks_info) > 0:
+            changed |= self.bid(local_tasks_info, epsilon)
+
+        if changed:
+            self.publish_message()
+
+        return self.assigned_task.task_id if self.assigned_task is not None else None
+
+    def is_local_task_set_changed(self, local_tasks_info):
+        """
+        Whether a task that arrived or completed since the last check is (or was, at the previous decision) one of the local tasks
+        """
+        local_task_ids = {task.task_id for task in local_tasks_info}
+        local_task_ids.update(task.task_id for task in self.last_local_tasks_info)
+        return any(task.task_id in local_task_ids for task in task_set_monitor.get_changed_tasks(self.task_set_version))
+
+    def ensure_capacity(self, num_tasks):
+        """
+        Grow the state arrays to cover `num_tasks` tasks (new tasks have no bidder and price 0)
+        """
+        if num_tasks > len(self.prices):
+            self.prices = pad_array(self.prices, num_tasks, 0.0)
+            self.bidders = pad_array(self.bidders, num_tasks, NO_AGENT)
+
+    def merge_messages(self, messages):
+        """
+        Take the highest (price, bidder) of each task from the received lists (in place); returns whether anything changed
+        """
+        changed = False
+        for message in messages:
+            if not message or self.merged_messages.get(message['agent_id']) is message:
+                continue
+            self.merged_messages[message['agent_id']] = message
+            # The sender may not know the newest tasks yet
+            prices_k = message['prices'][:len(self.prices)]
+            bidders_k = message['bidders'][:len(self.prices)]
+            num_tasks = len(prices_k)
+            prices = self.prices[:num_tasks]
+            higher = (prices_k > prices) | ((prices_k == prices) & (bidders_k > self.bidders[:num_tasks]))
+            if higher.any():
+                self.prices = get_writable(self.prices)
+                self.bidders = get_writable(self.bidders)
+                self.prices[:num_tasks][higher] = prices_k[higher]
+                self.bidders[:num_tasks][higher] = bidders_k[higher]
+                changed = True
+        return changed
+
+    def get_values(self, tasks_info):
+        """
+        Task ids of `tasks_info` and their values to the agent (benefit - price)
+        """
+        task_ids = np.fromiter((task.task_id for task in tasks_info), dtype=np.int64, count=len(tasks_info))
+        benefits = get_benefits(cost_matrix.get_distances(self.agent, tasks_info), get_task_amounts(tasks_info), self.agent.max_speed, self.agent.work_rate)
+        return task_ids, benefits - self.prices[task_ids]
+
+    def bid(self, tasks_info, epsilon):
+        """
+        Bid on the best task among `tasks_info` if it is worth more than staying unassigned; returns whether the agent bid
+        """
+        task_ids, values = self.get_values(tasks_info)
+        best_columns, best_values, second_values = get_best_two_values(values[None, :])
+        if best_values[0] <= 0:
+            return False
+
+        best_task_id = int(task_ids[best_columns[0]])
+        self.prices = get_writable(self.prices)
+        self.bidders = get_writable(self.bidders)
+        self.prices[best_task_id] += best_values[0] - max(second_values[0], 0.0) + epsilon
+        self.bidders[best_task_id] = self.agent.agent_id
+        self.assigned_task = tasks_info[best_columns[0]]
+        return True
+
+    def publish_message(self):
+        # The lists are shared with the message (see `get_writable()`)
+        self.prices.flags.writeable = False
+        self.bidders.flags.writeable = False
+        self.agent.message_to_share = {
+            'agent_id': self.agent.agent_id,
+            'prices': self.prices,
+            'bidders': self.bidders
+        }
+
+
+class CentralizedAuction(Auction): # The reference solver for the whole swarm in one call per tick
+    """
+    `solve_assignment()` on the benefit matrix of all deciding agents (`decide_batch()`; requires `decision_making.delegate_to_plugin: True`).
+    Each agent only gets tasks within its situation awareness radius, and the tasks carried by the other agents are excluded.
+    """
+    @classmethod
+    def decide_batch(cls, agent_views, blackboards):
+        task_list = agent_views.task_list
+        task_columns = agent_views.cost_matrix.task_columns
+        agent_ids = np.flatnonzero(agent_views.active)
+
+        allowed = agent_views.local_task_mask[agent_ids]
+        carried_columns = [task_columns.get(blackboard.assigned_task_id) for blackboard, active in zip(blackboards, agent_views.active) if not active]
+        allowed[:, [column for column in carried_columns if column is not None]] = False
+
+        speeds = np.array([agent_views.agents[agent_id].max_speed for agent_id in agent_ids], dtype=float)
+        work_rates = np.array([agent_views.agents[agent_id].work_rate for agent_id in agent_ids], dtype=float)
+        benefits = get_benefits(agent_views.distances[agent_ids], get_task_amounts(task_list), speeds[:, None], work_rates[:, None])
+        assignment, _ = solve_assignment(np.where(allowed, benefits, -np.inf))
+
+        task_ids = [None] * len(agent_views.agents)
+        for agent_id, column in zip(agent_ids, assignment):
+            decision_maker = agent_views.decision_makers[agent_id]
+            decision_maker.assigned_task = task_list[column] if column != NO_AGENT else None
+            task_ids[agent_id] = decision_maker.assigned_task.task_id if decision_maker.assigned_task is not None else None
+        for agent_id in np.flatnonzero(~agent_views.active):
+            assigned_task = agent_views.decision_makers[agent_id].assigned_task
+            task_ids[agent_id] = assigned_task.task_id if assigned_task is not None else None
+        return task_ids
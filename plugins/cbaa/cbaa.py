@@ -1,16 +1,39 @@
-from modules.utils import config, merge_dicts
-# MY_PARAMETER = config['decision_making']['my_decision_making_plugin']['my_parameter']
+import numpy as np
+from modules.utils import config
+from modules.events import TaskCompletionWatch
+from modules.cost_matrix import cost_matrix, get_task_amounts, time_discounted_reward
+LAMBDA = (config['decision_making'].get('CBAA', {}) or {}).get('task_reward_discount_factor', 0.999) # Time discount of the task reward
+
+def pad_array(array, size, fill_value):
+    # The state arrays grow as tasks are generated; the new rows hold `fill_value`
+    if len(array) >= size:
+        return array[:size]
+    return np.concatenate((array, np.full(size - len(array), fill_value, dtype=array.dtype)))
+
+def get_writable(array):
+    # The winning bid list is shared read-only with the published message, so it is copied before the first change
+    return array if array.flags.writeable else array.copy()
 
 # Define decision-making class
 class CBAA:
     def __init__(self, agent):
         self.agent = agent       
-        self.assigned_task = None
+        self.assigned_task_watch = TaskCompletionWatch()
         self.satisfied = False # Rename if necessary
 
         # Define any variables if necessary
-        self.x = {} # task assignment (key: task id; value: 0 or 1)
-        self.y = {} # winning bid list (key: task id; value: bid value)
+        # Dense arrays indexed by task_id, grown as tasks are generated (see `ensure_capacity()`)
+        self.x = np.zeros(0, dtype=np.int8) # task assignment (0 or 1)
+        self.y = np.full(0, np.nan) # winning bid list (NaN: no bid known)
+
+    @property
+    def assigned_task(self):
+        return self.assigned_task_watch.task
+
+    @assigned_task.setter
+    def assigned_task(self, task):
+        # Subscribes to the task's `TaskCompleted` (see `TaskCompletionWatch`)
+        self.assigned_task_watch.watch(task)
 
 
     def decide(self, blackboard):
@@ -23,14 +46,15 @@ class CBAA:
         # Get local information from the blackboard
         local_tasks_info = blackboard['local_tasks_info']
         local_agents_info = blackboard['local_agents_info']
+        self.ensure_capacity(len(self.agent.tasks_info))
 
         # Post-process if the previously assigned task is done        
-        if self.assigned_task is not None and self.assigned_task.completed:            
+        if self.assigned_task_watch.completed:            
             # Implement your idea
             self.assigned_task = None
             self.satisfied = False
-            self.x = {} 
-            self.y = {} 
+            self.x = np.zeros(len(self.x), dtype=np.int8)
+            self.y = np.full(len(self.y), np.nan)
 
 
         # Give up the decision-making process if there is no task nearby 
@@ -42,25 +66,24 @@ class CBAA:
             # Implement your idea (local decision-making)
 
             # Line 5
-            selectable_tasks = {}
-            task_rewards = {}
-            for task in local_tasks_info:
-                task_reward = self.calculate_score(task)
-                if task.task_id not in self.y or task_reward > self.y[task.task_id]:
-                    selectable_tasks[task.task_id] = task
-                    task_rewards[task.task_id] = task_reward
-
-                
+            task_ids = np.fromiter((task.task_id for task in local_tasks_info), dtype=np.int64, count=len(local_tasks_info))
+            task_rewards = self.calculate_scores(local_tasks_info)
+            winning_bids = self.y[task_ids]
+            selectable = np.isnan(winning_bids) | (task_rewards > winning_bids)
+
             # Line 6-10
-            if selectable_tasks:
-                best_task_id = max(task_rewards, key=task_rewards.get) # Line 7
+            if selectable.any():
+                best_idx = int(np.argmax(np.where(selectable, task_rewards, -np.inf))) # Line 7
+                best_task_id = int(task_ids[best_idx])
                 self.x[best_task_id] = 1 # Line 8
-                self.y[best_task_id] = task_rewards[best_task_id] # Line 9
+                self.y = get_writable(self.y)
+                self.y[best_task_id] = task_rewards[best_idx] # Line 9
 
-                self.assigned_task = selectable_tasks[best_task_id]
+                self.assigned_task = local_tasks_info[best_idx]
 
 
                 # Broadcasting
+                self.y.flags.writeable = False # Shared with the message (see `get_writable()`)
                 self.agent.message_to_share = {
                     # Implement your idea (data to share)
                     'agent_id': self.agent.agent_id,
@@ -68,7 +91,7 @@ class CBAA:
                 }
                 self.satisfied = True
 
-            else:
+            elif self.agent.message_to_share: # Republish only if there was something to withdraw
                 self.agent.message_to_share = {}                                
             return None
             
@@ -78,15 +101,21 @@ class CBAA:
             best_task_id = self.assigned_task.task_id
 
             # Line 4~5
-            winner_agent_candidates = {self.agent.agent_id: self.y[best_task_id]} # Initialization with myself            
+            winner_agent_candidates = {self.agent.agent_id: self.y[best_task_id]} # Initialization with myself
+            merged_bids = None
             for other_agent_message in self.agent.messages_received:
                 if other_agent_message:
-                    y_k = other_agent_message.get('winning_bids')
-                    self.y = merge_dicts(self.y, y_k) # Line 4: Winning Bid Update
-                    if y_k.get(best_task_id): 
+                    y_k = other_agent_message.get('winning_bids')[:len(self.y)] # The sender may not know the newest tasks yet
+                    # Line 4: Winning Bid Update (element-wise max, accumulated in place; NaN, i.e., no bid, never wins)
+                    if merged_bids is None:
+                        merged_bids = self.y.copy()
+                    np.fmax(merged_bids[:len(y_k)], y_k, out=merged_bids[:len(y_k)])
+                    if best_task_id < len(y_k) and y_k[best_task_id] > 0: # A positive bid on my task
                          k_agent_id = other_agent_message.get('agent_id')
                          winner_agent_candidates[k_agent_id] = y_k[best_task_id]
-            
+            if merged_bids is not None:
+                self.y = merged_bids
+
             winner_agent_id = max(winner_agent_candidates, key=winner_agent_candidates.get)
 
 
@@ -102,18 +131,16 @@ class CBAA:
             return self.assigned_task.task_id if self.assigned_task is not None else None
 
 
-    def calculate_score(self, task):
-        distance_to_task = self.agent.position.distance_to(task.position)
-        # Time-discounted reward
-        LAMBDA = 0.999
-        expected_reward = LAMBDA**(distance_to_task/self.agent.max_speed + task.amount/self.agent.work_rate)*task.amount          
-        return expected_reward
-    
-    def update_dict_based_on_comparison(my_dict, other_dict):
-        my_dict_updated = {}
-        
-        for key, value in my_dict.items():            
-            if key not in other_dict or value > other_dict[key]:
-                my_dict_updated[key] = value
-        
-        return my_dict_updated    
\ No newline at end of file
+    def calculate_scores(self, tasks_info):
+        # Time-discounted rewards of all tasks in one pass over the shared cost matrix
+        distances = cost_matrix.get_distances(self.agent, tasks_info)
+        expected_rewards = time_discounted_reward(distances, get_task_amounts(tasks_info), self.agent.max_speed, self.agent.work_rate, LAMBDA)
+        return expected_rewards
+
+    def ensure_capacity(self, num_tasks):
+        """
+        Grow the state arrays to cover `num_tasks` tasks (new tasks are unassigned and have no bid)
+        """
+        if num_tasks > len(self.y):
+            self.x = pad_array(self.x, num_tasks, 0)
+            self.y = pad_array(self.y, num_tasks, np.nan)
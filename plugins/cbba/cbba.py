@@ -1,46 +1,91 @@
-import random
+import math
 import pygame
 from modules.utils import config
 from enum import Enum
 import numpy as np
-import copy
 import time
-from modules.utils import merge_dicts
+from modules.trace import get_tracer
+from modules.events import TaskCompletionWatch
 
 KEEP_MOVING_DURING_CONVERGENCE = config['decision_making']['CBBA'].get('execute_movements_during_convergence', False)
 MAX_TASKS_PER_AGENT = config['decision_making']['CBBA']['max_tasks_per_agent']
 LAMBDA = config['decision_making']['CBBA']['task_reward_discount_factor']
 WINNING_BID_CANCEL = config['decision_making']['CBBA']['winning_bid_cancel']
 NO_BUNDLE_DURATION = config['decision_making']['CBBA']['acceptable_empty_bundle_duration']
+BUNDLE_EVALUATION_BUDGET = config['decision_making']['CBBA'].get('bundle_evaluation_budget', 0) # Path score evaluations per tick; 0 means unlimited
+BUNDLE_TIME_BUDGET = config['decision_making']['CBBA'].get('bundle_time_budget', 0) # sec (wall time) per tick; 0 means unlimited
 SAMPLE_FREQ = config['simulation']['sampling_freq']
 SAMPLE_TIME = 1.0 / SAMPLE_FREQ  # in seconds
+trace = get_tracer('cbba')
+NO_AGENT = -1 # No winning agent (`None`) in the winning agent list
+
+def pad_array(array, size, fill_value):
+    # A received state array sized for fewer tasks/agents, padded with "no information"
+    if len(array) >= size:
+        return array[:size]
+    return np.concatenate((array, np.full(size - len(array), fill_value, dtype=array.dtype)))
+
+def get_writable(array):
+    # Copy-on-write: a state array shared with a published message is read-only, so it is copied before the first change
+    return array if array.flags.writeable else array.copy()
 
 class Phase(Enum):
     BUILD_BUNDLE = 1
     ASSIGNMENT_CONSENSUS = 2
 
+# Per-tick compute budget of the bundle construction (anytime CBBA)
+class ComputeBudget:
+    def __init__(self, max_evaluations=0, max_time=0):
+        self.evaluations_left = max_evaluations if max_evaluations > 0 else float('inf')
+        self.deadline = time.perf_counter() + max_time if max_time > 0 else None
+
+    def spend(self, evaluations):
+        self.evaluations_left -= evaluations
+
+    def exhausted(self):
+        return self.evaluations_left <= 0 or (self.deadline is not None and time.perf_counter() > self.deadline)
+
+# Candidate evaluation for one bundle insertion (Algorithm 3, Line 7), resumable across ticks
+class BundleInsertionRound:
+    def __init__(self, agent_position, path, local_tasks_info):
+        self.agent_position = pygame.Vector2(agent_position)
+        self.path = path[:] # The path that the bids are computed for
+        self.candidates = list(local_tasks_info)
+        self.next_candidate = 0
+        self.path_cache = None # See `CBBA.build_path_cache()`
+        self.my_bid_list = {} # key: task_id; value: bid value
+        self.best_insertion_idx_list = {} # key: task_id; value: bundle insertion position
+
 class CBBA:  
     def __init__(self, agent):
         self.agent = agent        
 
-        self.z = {} # Winning agent list (key: task_id; value: agent_id)
-        self.y = {} # Winning bid list (key: task_id; value: bid value)
-        self.s = {} # Time stamp list (key: agent_id; value: time stamp)
+        # Dense arrays indexed by task_id (z, y) and agent_id (s), grown as tasks are generated (see `ensure_capacity()`)
+        self.z = np.full(0, NO_AGENT, dtype=np.int64) # Winning agent list (NO_AGENT: none)
+        self.y = np.full(0, np.nan) # Winning bid list (NaN: no bid known)
+        self.s = np.full(0, np.nan) # Time stamp list (NaN: no time stamp known)
         self.bundle = [] # Bundle (a list of task id)      
         self.path = [] # Path (a list of task object) 
 
         self.phase = Phase.BUILD_BUNDLE
 
-        self.agent.message_to_share = { # Message Initialization
-            'agent_id': self.agent.agent_id,
-            'winning_agents': self.z, 
-            'winning_bids': self.y,
-            'message_received_time_stamp': self.s
-            } 
+        self.publish_message() # Message Initialization
         
         
-        self.assigned_task = None
+        self.assigned_task_watch = TaskCompletionWatch()
         self.no_bundle_duration = 0
+        self.insertion_round = None # Suspended candidate evaluation (see `build_bundle()`)
+        self.bundle_incomplete = False # True if the last bundle construction was suspended by the compute budget
+        self.processed_messages = {} # key: sender agent_id; value: (message, z, y, s) of the last consensus that it did not change
+
+    @property
+    def assigned_task(self):
+        return self.assigned_task_watch.task
+
+    @assigned_task.setter
+    def assigned_task(self, task):
+        # Subscribes to the task's `TaskCompleted` (see `TaskCompletionWatch`)
+        self.assigned_task_watch.watch(task)
 
     def decide(self, blackboard):
         # Place your decision-making code for each agent
@@ -50,9 +95,10 @@ class CBBA:
             - `None`, otherwise
         '''        
         local_tasks_info = blackboard['local_tasks_info']
+        self.ensure_capacity(len(self.agent.tasks_info), len(self.agent.agents_info or ()))
 
         # Check if the existing task is done
-        if self.assigned_task is not None and self.assigned_task.completed:
+        if self.assigned_task_watch.completed:
             if len(self.path) != 0 and self.path[0] == self.assigned_task:
                 self.path.pop(0)
                 self.bundle.pop(0)
@@ -73,139 +119,38 @@ class CBBA:
 
             if self.no_bundle_duration > NO_BUNDLE_DURATION:
                 # Neutralize
-                self.z = {} 
-                self.y = {} 
-                self.s = {}                  
+                self.z = np.full(len(self.z), NO_AGENT, dtype=np.int64)
+                self.y = np.full(len(self.y), np.nan)
+                self.s = np.full(len(self.s), np.nan)
                 self.no_bundle_duration = 0         
 
         # Look for a task within situation awareness radius if there is no existing assigned task
         # if self.assigned_task is None:
         if self.phase == Phase.BUILD_BUNDLE:
-            # Phase 1 Build Bundle 
-            self.build_bundle(local_tasks_info)            
+            # Anytime: a task chosen from a converged partial bundle stays assigned while the bundle is extended
+            resuming = self.bundle_incomplete and self.assigned_task is not None
+            # Phase 1 Build Bundle (possibly suspended by the compute budget; the partial bundle is still valid for consensus)
+            self.bundle_incomplete = not self.build_bundle(local_tasks_info)
             # Broadcasting
-            self.agent.message_to_share = { 
-                'agent_id': self.agent.agent_id,
-                'winning_agents': copy.deepcopy(self.z), 
-                'winning_bids': copy.deepcopy(self.y),
-                'message_received_time_stamp': copy.deepcopy(self.s)
-                } 
+            self.publish_message()
             
             self.phase = Phase.ASSIGNMENT_CONSENSUS
             self.agent.set_planned_tasks(self.path) # For visualisation
+            if resuming and self.assigned_task in self.path:
+                return self.assigned_task.task_id
             self.assigned_task = None   # 아직 consensus 안된거니까 None 이라고 해줘야함
             return None
         
         if self.phase == Phase.ASSIGNMENT_CONSENSUS:
             self.update_time_stamp()
             # Phase 2 Consensus
-            for task in local_tasks_info: 
-                for other_agent_message in self.agent.messages_received:
-                    k_agent_id = other_agent_message.get('agent_id')
-                    if k_agent_id == self.agent.agent_id:
-                        continue
-                    z_k = other_agent_message.get('winning_agents')
-                    y_k = other_agent_message.get('winning_bids')
-                    s_k = other_agent_message.get('message_received_time_stamp')
-
-                    z_i = self.z
-                    y_i = self.y
-                    s_i = self.s
-
-                    j = task.task_id
-                    if y_k.get(j) is None or y_i.get(j) is None:
-                        continue
-
-                    try:    
-                        if z_k[j] == k_agent_id:
-                            # Rule 1
-                            if z_i[j] == self.agent.agent_id:
-                                if y_k[j] > y_i[j]:
-                                    self._update(j, y_k, z_k)
-                            # Rule 2
-                            elif z_i[j] == k_agent_id:
-                                self._update(j, y_k, z_k)
-                            # Rule 4
-                            elif z_i[j] == None:
-                                self._update(j, y_k, z_k)     
-                            # Rule 3
-                            else:
-                                m = z_i[j]                                                                                    
-                                try: 
-                                    if s_k.get(m) > s_i.get(m) or y_k[j] > y_i[j]:
-                                        self._update(j, y_k, z_k)   
-                                except Exception as e:
-                                    pass                                
-
-                        elif z_k[j] == self.agent.agent_id:
-                            # Rule 5
-                            if z_i[j] == self.agent.agent_id:
-                                self._leave()                            
-                            # Rule 6
-                            elif z_i[j] == k_agent_id:
-                                self._reset(j)
-                            # Rule 8
-                            elif z_i[j] == None:
-                                self._leave()                            
-                            # Rule 7
-                            else:
-                                m = z_i[j]    
-                                try:                        
-                                    if s_k.get(m) > s_i.get(m):
-                                        self._reset(j)
-                                except Exception as e:
-                                    pass
-
-                        elif z_k[j] == None:
-                            # Rule 14
-                            if z_i[j] == self.agent.agent_id:
-                                self._leave()                            
-                            # Rule 15
-                            elif z_i[j] == k_agent_id:
-                                self._update(j, y_k, z_k)  
-                            # Rule 17
-                            elif z_i[j] == None:
-                                self._leave()                            
-                            # Rule 16
-                            else:
-                                m = z_i[j]                            
-                                if s_k.get(m) > s_i.get(m):
-                                    self._reset(j)
-                        
-                        else:
-                            m = z_k[j]                        
-                            # Rule 9
-                            if z_i[j] == self.agent.agent_id:
-                                if s_k.get(m) > s_i.get(m) and y_k[j] > y_i[j]:
-                                    self._update(j, y_k, z_k)                                                         
-                            # Rule 10
-                            elif z_i[j] == k_agent_id:
-                                if s_k.get(m) > s_i.get(m):
-                                    self._update(j, y_k, z_k)        
-                                else:
-                                    self._reset(j)
-                            # Rule 11
-                            elif z_i[j] == m:                            
-                                if s_k.get(m) > s_i.get(m):
-                                    self._update(j, y_k, z_k)                                    
-                            # Rule 13
-                            elif z_i[j] == None:
-                                if s_k.get(m) > s_i.get(m):
-                                    self._update(j, y_k, z_k)                                    
-                            # Rule 12
-                            else:
-                                n = z_i[j]                        
-                                try:
-                                    if s_k.get(m) > s_i.get(m) and s_k.get(n) > s_i.get(n):
-                                        self._update(j, y_k, z_k)
-                                    elif s_k.get(m) > s_i.get(m) and y_k[j] > y_i[j]:
-                                        self._update(j, y_k, z_k)                        
-                                    elif s_k.get(n) > s_i.get(n) and s_i.get(m) > s_k.get(m):
-                                        self._reset(j)
-                                except Exception as e:
-                                    pass
-                    except Exception as e:
-                        pass
+            messages = [message for message in self.agent.messages_received if message.get('agent_id') != self.agent.agent_id]
+            # Skipped if no sender's message has changed since a consensus that they did not change
+            if messages and not all(self.is_message_processed(message) for message in messages):
+                if not self.apply_consensus_rules(messages, [task.task_id for task in local_tasks_info]):
+                    self.freeze_state()
+                    for message in messages:
+                        self.processed_messages[message.get('agent_id')] = (message, self.z, self.y, self.s)
 
             # Bundle Update
             updated_bundle, updated_path = self.update_bundle_and_path()
@@ -221,6 +166,8 @@ class CBBA:
 
                 # _next_assigned_task = next((task for task in self.agent.assigned_tasks if task.completed is False), None)
                 self.assigned_task = self.path[0] if self.path else None
+                if self.bundle_incomplete:
+                    self.phase = Phase.BUILD_BUNDLE # Anytime: keep extending the bundle in the next tick
                 
                 return self.assigned_task.task_id if self.assigned_task is not None else None
 
@@ -239,17 +186,143 @@ class CBBA:
             self.agent.reset_movement()  # Neutralise the agent's current movement during converging to a consensus
             return None
     
-    def _update(self, task_id, y_k, z_k):
-        self.y[task_id] = y_k[task_id]   # Winning bid update
-        self.z[task_id] = z_k[task_id]   # Winning agent update
-
-
-    def _reset(self, task_id):
-        self.y[task_id] = 0     # Winning bid reset
-        self.z[task_id] = None  # Winning agent reset
+    def apply_consensus_rules(self, messages, task_ids):
+        """
+        Decision rules (Table 1 in the CBBA paper) for the tasks `task_ids` and the received `messages`, applied in message order.
+        The rules are evaluated for all (message, task) pairs at once; each task takes the action of the first message that
+        triggers one, and only those tasks are re-evaluated against the later messages (until no action is left).
+        Actions that would leave the task's state as it is (e.g., Rule 2 with the same bid) are skipped.
+        Returns False if the state has not changed, i.e., applying the messages again would not change it either.
+        """
+        num_tasks = len(self.y)
+        K = np.array([message.get('agent_id') for message in messages])[:, None]
+        Z = np.stack([pad_array(message.get('winning_agents'), num_tasks, NO_AGENT) for message in messages])
+        Y = np.stack([pad_array(message.get('winning_bids'), num_tasks, np.nan) for message in messages])
+        S = np.stack([pad_array(message.get('message_received_time_stamp'), len(self.s), np.nan) for message in messages])
+        message_idx = np.arange(len(messages))[:, None]
+
+        tasks = np.asarray(task_ids, dtype=np.int64)
+        next_message = np.zeros(len(tasks), dtype=np.int64) # The first message (per task) not applied yet
+        changed = False
+        while True:
+            Z_tasks, Y_tasks = Z[:, tasks], Y[:, tasks]
+            update, reset = self.get_consensus_actions(Z_tasks, Y_tasks, S, K, tasks)
+            update &= (Z_tasks != self.z[tasks]) | (Y_tasks != self.y[tasks])
+            reset &= (self.z[tasks] != NO_AGENT) | (self.y[tasks] != 0)
+            action = (update | reset) & (message_idx >= next_message)
+            acted = np.flatnonzero(action.any(axis=0))
+            if len(acted) == 0:
+                break
+            changed = True
+            self.z, self.y = get_writable(self.z), get_writable(self.y)
+            tasks = tasks[acted]
+            first = action[:, acted].argmax(axis=0)
+            is_update = update[first, acted]
+            updated, updated_first = tasks[is_update], first[is_update]
+            self.y[updated] = Y[updated_first, updated]  # Winning bid update
+            self.z[updated] = Z[updated_first, updated]  # Winning agent update
+            self.y[tasks[~is_update]] = 0                # Winning bid reset
+            self.z[tasks[~is_update]] = NO_AGENT         # Winning agent reset
+            next_message = first + 1
+        return changed
+
+    def is_message_processed(self, message):
+        """
+        Whether `message` (the same broadcast, as a cached reference) was already applied to the current state.
+        The state arrays are frozen after such a consensus, so they are the same objects only if they have not changed since.
+        """
+        processed = self.processed_messages.get(message.get('agent_id'))
+        return (
+            processed is not None and processed[0] is message
+            and processed[1] is self.z and processed[2] is self.y and processed[3] is self.s
+        )
+
+    def freeze_state(self):
+        # Read-only state arrays: the next change copies them (see `get_writable()`)
+        for array in (self.z, self.y, self.s):
+            array.flags.writeable = False
+
+    def publish_message(self):
+        """
+        Broadcast the winning agents/bids and the time stamps in O(1): the state arrays are frozen (read-only) and shared
+        with the receivers as they are. This agent copies an array only when it changes it next (see `get_writable()`).
+        """
+        self.freeze_state()
+        self.agent.message_to_share = {
+            'agent_id': self.agent.agent_id,
+            'winning_agents': self.z,
+            'winning_bids': self.y,
+            'message_received_time_stamp': self.s
+            }
 
-    def _leave(self):
-        pass
+    def get_consensus_actions(self, z_k, y_k, s_k, k, tasks):
+        """
+        Update/reset masks (messages x tasks) of the decision rules against the current state of `tasks`.
+        Same outcomes as evaluating the rules pair by pair: a pair is skipped unless both agents have a bid on the task,
+        and a rule whose time stamp comparison involves an agent without a time stamp (on either side) takes no action.
+        Rules 5, 8, 14 and 17 (leave) take no action.
+        """
+        i = self.agent.agent_id
+        z_i, y_i, s_i = self.z[tasks], self.y[tasks], self.s
+
+        def compare_time_stamps(m):
+            # (both time stamps of agent m known, s_k[m] > s_i[m], s_i[m] > s_k[m])
+            m_idx = np.where(m >= 0, m, 0)
+            s_k_m, s_i_m = np.take_along_axis(s_k, m_idx, axis=1), s_i[m_idx]
+            known = (m >= 0) & ~np.isnan(s_k_m) & ~np.isnan(s_i_m)
+            return known, known & (s_k_m > s_i_m), known & (s_i_m > s_k_m)
+
+        active = ~np.isnan(y_k) & ~np.isnan(y_i)
+        y_k_higher = y_k > y_i
+        z_i = np.broadcast_to(z_i, z_k.shape)
+        z_i_is_i, z_i_is_k, z_i_is_none = z_i == i, z_i == k, z_i == NO_AGENT
+        z_i_is_other = ~(z_i_is_i | z_i_is_k | z_i_is_none) # m (or n in Rule 12) = z_i[j]
+        known_z_i, newer_z_i, _ = compare_time_stamps(z_i)
+        known_z_k, newer_z_k, older_z_k = compare_time_stamps(z_k)
+
+        z_k_is_k, z_k_is_i, z_k_is_none = z_k == k, z_k == i, z_k == NO_AGENT
+        z_k_is_other = ~(z_k_is_k | z_k_is_i | z_k_is_none) # m = z_k[j]
+        z_i_is_m = z_i == z_k
+        z_i_is_n = z_i_is_other & ~z_i_is_m
+
+        update = active & (
+            z_k_is_k & (
+                (z_i_is_i & y_k_higher)                                  # Rule 1
+                | z_i_is_k                                               # Rule 2
+                | (z_i_is_other & known_z_i & (newer_z_i | y_k_higher))  # Rule 3
+                | z_i_is_none                                            # Rule 4
+            )
+            | z_k_is_other & (
+                (z_i_is_i & newer_z_k & y_k_higher)                      # Rule 9
+                | (z_i_is_k & newer_z_k)                                 # Rule 10
+                | (z_i_is_m & newer_z_k)                                 # Rule 11
+                | (z_i_is_n & newer_z_k & known_z_i & (newer_z_i | y_k_higher)) # Rule 12
+                | (z_i_is_none & newer_z_k)                              # Rule 13
+            )
+            | z_k_is_none & z_i_is_k                                     # Rule 15
+        )
+        reset = active & (
+            z_k_is_i & (
+                z_i_is_k                                                 # Rule 6
+                | (z_i_is_other & newer_z_i)                             # Rule 7
+            )
+            | z_k_is_other & (
+                (z_i_is_k & known_z_k & ~newer_z_k)                      # Rule 10
+                | (z_i_is_n & newer_z_i & older_z_k)                     # Rule 12
+            )
+            | z_k_is_none & z_i_is_other & newer_z_i                     # Rule 16
+        )
+        return update, reset
+
+    def ensure_capacity(self, num_tasks, num_agents):
+        """
+        Grow the state arrays to cover `num_tasks` tasks and `num_agents` agents (new entries hold no information)
+        """
+        if num_tasks > len(self.y):
+            self.z = pad_array(self.z, num_tasks, NO_AGENT)
+            self.y = pad_array(self.y, num_tasks, np.nan)
+        if num_agents > len(self.s):
+            self.s = pad_array(self.s, num_agents, np.nan)
 
     def update_bundle_and_path(self):
         _n_bar = len(self.bundle)
@@ -270,19 +343,29 @@ class CBBA:
         """
         Construct bundle and path list with local information.
         Algorithm 3 in CBBA paper
+        Anytime: with `bundle_evaluation_budget`/`bundle_time_budget`, the construction is suspended once the budget of this tick
+        is used up and resumed in a later tick. The bundle built so far is always a valid CBBA bundle.
+        Returns False if suspended.
         """
         # J = list(range(self.task_num))
-        
+        budget = ComputeBudget(BUNDLE_EVALUATION_BUDGET, BUNDLE_TIME_BUDGET)
 
         while len(self.bundle) < min(MAX_TASKS_PER_AGENT, len(local_tasks_info)):
-            # Calculate S_p for the constructed path list
-            
-
-            # Line 7
-            my_bid_list, best_insertion_idx_list = self.get_my_bid_value_list(local_tasks_info) 
+            # Line 7 (resumes the suspended evaluation unless the path has changed since)
+            if self.insertion_round is None or self.insertion_round.path != self.path:
+                self.insertion_round = BundleInsertionRound(self.agent.position, self.path, local_tasks_info)
+            if not self.evaluate_bids(self.insertion_round, budget):
+                return False
+            insertion_round = self.insertion_round
+            self.insertion_round = None
+            my_bid_list = {
+                task_id: bid for task_id, bid in insertion_round.my_bid_list.items()
+                if not self.agent.tasks_info[task_id].completed # Completed while the evaluation was suspended
+            }
+            best_insertion_idx_list = insertion_round.best_insertion_idx_list
 
             # Line 8~9
-            task_to_add = self.get_best_task(my_bid_list)
+            task_to_add = self.get_best_task(my_bid_list) if my_bid_list else None
 
             if task_to_add is None:
                 break
@@ -294,10 +377,13 @@ class CBBA:
             # Line 12
             self.path.insert(best_insertion_idx, task_to_add)
             # Line 13
+            self.z, self.y = get_writable(self.z), get_writable(self.y)
             self.y[task_to_add.task_id] = my_bid_list[task_to_add.task_id]
             # LIne 14
             self.z[task_to_add.task_id] = self.agent.agent_id
 
+        return True
+
     
     def update_time_stamp(self):
         """
@@ -306,72 +392,111 @@ class CBBA:
 
         # For neighbor agents
         current_timestamp = int(time.time())
-        for other_agent in self.agent.agents_nearby:            
-            self.s[other_agent.agent_id] = current_timestamp
+        s = self.s.copy()
+        s[[other_agent.agent_id for other_agent in self.agent.agents_nearby]] = current_timestamp
 
-        
-        # For two-hop neighbor agents
-        max_timestamp = {}     
+        # For two-hop neighbor agents (elementwise max; NaN means unknown)
         for other_agent_message in self.agent.messages_received:
             time_stamp = other_agent_message.get("message_received_time_stamp")
-            max_timestamp = merge_dicts(max_timestamp, time_stamp)
-
-        # Finally merge
-        self.s = merge_dicts(self.s, max_timestamp)
-        
+            np.fmax(s, pad_array(time_stamp, len(s), np.nan), out=s)
 
+        # The state is only replaced if a time stamp has changed (see `is_message_processed()`)
+        if not np.array_equal(s, self.s, equal_nan=True):
+            self.s = s
 
-
-    def get_my_bid_value_list(self, local_tasks_info):
-        # Calculate S_p for the constructed path list
-        S_p = self.calculate_score_along_path(self.agent.position, self.path)
-
-        my_bid_list = {} # My new bid list (key: task_id; value: bid value), denoted by 'c' in the paper (Algorithm 3 Line 3)
-        best_insertion_idx_list = {} # (key: task_id; value: bundle insertion position)
-        
-        for task in local_tasks_info:
-            _marginal_score_by_new_task = []
-            if task in self.path: # TODO: This might take longer computation
+    def build_path_cache(self, agent_position, path):
+        """
+        Cached quantities along `path` for O(1) marginal insertion scores (see `get_marginal_scores()`), for each insertion index k:
+        - `points[k]`: the point before the insertion (the agent position for k = 0)
+        - `prefix_distances[k]`: distance travelled along the path up to `points[k]`
+        - `segment_distances[k]`: distance from `points[k]` to the next task on the path (k < L)
+        - `suffix_rewards[k]`: sum of the time-discounted rewards of the tasks after the insertion (path[k:])
+        """
+        points = [(agent_position[0], agent_position[1])] + [(task.position[0], task.position[1]) for task in path]
+        prefix_distances = [0.0]
+        segment_distances = []
+        rewards = []
+        for k, task in enumerate(path):
+            (x0, y0), (x1, y1) = points[k], points[k + 1]
+            segment_distance = math.sqrt((x1 - x0) * (x1 - x0) + (y1 - y0) * (y1 - y0))
+            segment_distances.append(segment_distance)
+            prefix_distances.append(prefix_distances[-1] + segment_distance)
+            rewards.append(LAMBDA**(prefix_distances[-1]/self.agent.max_speed + task.amount/self.agent.work_rate)*task.amount)
+        suffix_rewards = [0.0] * (len(path) + 1)
+        for k in range(len(path) - 1, -1, -1):
+            suffix_rewards[k] = suffix_rewards[k + 1] + rewards[k]
+        path_task_ids = {task.task_id for task in path}
+        return points, prefix_distances, segment_distances, suffix_rewards, path_task_ids
+
+    def get_marginal_scores(self, task, path_cache):
+        """
+        Marginal score S_{p (+)_k j} - S_p of inserting `task` (j) at each index k of the path, in O(1) per index:
+        the task's own time-discounted reward plus the extra discount of the tasks after it,
+        (LAMBDA**(detour/v) - 1) * suffix_rewards[k], where detour = d(p_k, j) + d(j, p_{k+1}) - d(p_k, p_{k+1})
+        """
+        points, prefix_distances, segment_distances, suffix_rewards, _ = path_cache
+        max_speed = self.agent.max_speed
+        task_x, task_y = task.position[0], task.position[1]
+        working_time = task.amount / self.agent.work_rate
+        path_length = len(segment_distances)
+
+        marginal_scores = []
+        distance_to_task = [
+            math.sqrt((task_x - x) * (task_x - x) + (task_y - y) * (task_y - y))
+            for x, y in points
+        ]
+        for k in range(path_length + 1):
+            marginal_score = LAMBDA**((prefix_distances[k] + distance_to_task[k])/max_speed + working_time)*task.amount
+            if k < path_length:
+                detour = distance_to_task[k] + distance_to_task[k + 1] - segment_distances[k]
+                marginal_score += (LAMBDA**(detour/max_speed) - 1.0) * suffix_rewards[k]
+            marginal_scores.append(marginal_score)
+        return marginal_scores
+
+    def evaluate_bids(self, insertion_round, budget):
+        """
+        Compute my bids (denoted by 'c' in the paper, Algorithm 3 Line 3) and the best insertion positions
+        for the remaining candidates of `insertion_round`. Returns False if the budget ran out first.
+        """
+        # Cache the prefix distances and suffix rewards of the constructed path list
+        if insertion_round.path_cache is None:
+            insertion_round.path_cache = self.build_path_cache(insertion_round.agent_position, self.path)
+        path_cache = insertion_round.path_cache
+        path_task_ids = path_cache[-1]
+
+        candidates = insertion_round.candidates
+        while insertion_round.next_candidate < len(candidates):
+            if budget.exhausted():
+                return False
+            task = candidates[insertion_round.next_candidate]
+            insertion_round.next_candidate += 1
+
+            if task.task_id in path_task_ids:
                 continue
 
-            for idx in range(len(self.path) + 1):
-                _alternative_path = self.get_alternative_path(self.path, task, idx)
-                S_p_plus_j_at_idx = self.calculate_score_along_path(self.agent.position, _alternative_path)
-                _marginal_score_by_new_task.append(S_p_plus_j_at_idx - S_p)
+            _marginal_score_by_new_task = self.get_marginal_scores(task, path_cache)
+            budget.spend(len(_marginal_score_by_new_task))
             
-            _best_insertion_idx = np.argmax(_marginal_score_by_new_task)
-            _c_ij = _marginal_score_by_new_task[_best_insertion_idx] # Line 7 in Algorithm 3
-            my_bid_list[task.task_id] = _c_ij
-            best_insertion_idx_list[task.task_id] = _best_insertion_idx
-
-        return my_bid_list, best_insertion_idx_list
-    
-    def get_alternative_path(self, path, task, idx):
-        # _new_path = copy.deepcopy(path)
-        _new_path = path[:] # Creates a shallow copy of the list
-        try:
-            if idx < 0:
-                raise IndexError("Index cannot be negative.")
-            elif idx > len(_new_path):
-                raise IndexError(f"Index {idx} out of range for list of length {len(_new_path)}.")
-            _new_path.insert(idx, task)
-            return _new_path
-        
-        except IndexError as e:
-            print(f"Error: {e}")        
+            # Line 7 in Algorithm 3 (the first index in case of a tie)
+            _best_insertion_idx = 0
+            for idx in range(1, len(_marginal_score_by_new_task)):
+                if _marginal_score_by_new_task[idx] > _marginal_score_by_new_task[_best_insertion_idx]:
+                    _best_insertion_idx = idx
+            _c_ij = _marginal_score_by_new_task[_best_insertion_idx]
+            insertion_round.my_bid_list[task.task_id] = _c_ij
+            insertion_round.best_insertion_idx_list[task.task_id] = _best_insertion_idx
+
+        return True
         
     def get_best_task(self, my_bid_list):
         """
         [Output] task object
         """
         ### Algorithm 3, Line 8
-        for task_id, winning_bid_value in self.y.items():
-            if task_id in my_bid_list:
-                if winning_bid_value > my_bid_list[task_id]:
-                    my_bid_list[task_id] = float('-inf')
-            else:
-                # Skip if y's key is not in my_bid_list
-                continue       
+        for task_id in my_bid_list:
+            # Skip if no winning bid is known (NaN compares False)
+            if self.y[task_id] > my_bid_list[task_id]:
+                my_bid_list[task_id] = float('-inf')
 
         ### Algorithm 3, Line 9        
         best_task_id = max(my_bid_list, key=my_bid_list.get)
@@ -379,23 +504,4 @@ class CBBA:
 
 
         return self.agent.tasks_info[best_task_id] if best_task_score > float('-inf') else None
-
-    def calculate_score_along_path(self, agent_position, path): 
-        """
-        Compute S^{p_i} in Eqn (11) in the CBBA paper 
-        """
-        
-        current_position = agent_position
-        expected_reward_from_task = 0
-        distance_to_next_task_from_start = 0
-        for task in path:
-            next_position = pygame.Vector2(task.position)
-            distance_to_next_task_from_start += current_position.distance_to(next_position)
-            # Time-discounted reward
-            expected_reward_from_task += LAMBDA**(distance_to_next_task_from_start/self.agent.max_speed + task.amount/self.agent.work_rate)*task.amount            
-            # expected_reward_from_task += (task.amount - (distance_to_next_task_from_start/self.agent.max_speed + task.amount/self.agent.work_rate))
-            current_position = next_position
-
-        return expected_reward_from_task
-
         
\ No newline at end of file
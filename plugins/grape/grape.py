@@ -1,12 +1,173 @@
 import random
 import copy
+import itertools
+import numpy as np
 from modules.utils import config, pre_render_text
+from modules.events import TaskCompletionWatch
+from modules.cost_matrix import cost_matrix, get_task_amounts, coalition_utility
 
 KEEP_MOVING_DURING_CONVERGENCE = config['decision_making']['GRAPE'].get('execute_movements_during_convergence', False)
 INITIALIZE_PARTITION = config['decision_making']['GRAPE']['initialize_partition']
 REINITIALIZE_PARTITION = config['decision_making']['GRAPE']['reinitialize_partition_on_completion']
 COST_WEIGHT_FACTOR = config['decision_making']['GRAPE']['cost_weight_factor']
 SOCIAL_INHIBITION_FACTOR = config['decision_making']['GRAPE']['social_inhibition_factor']
+PARTITION_DELTA_LOG_SIZE = config['decision_making']['GRAPE'].get('partition_delta_log_size', 32) # The number of recent partition changes carried in each message
+partition_versions = itertools.count(1) # Globally unique partition state ids (0: the empty partition)
+initial_partition_cache = {'scenario': None, 'partitions': {}} # Distance-based initial partitions shared by agents with the same view
+
+# Partition of the agents into task coalitions, indexed both ways and versioned for delta gossip
+class Partition:
+    """
+    - `members`: task_id -> set of agent_ids (the coalition of the task; only non-empty coalitions are kept)
+    - `task_of`: agent_id -> task_id (reverse index; an agent is in at most one coalition)
+    - `version`: id of the current state (0: the empty partition); every change gets a new, globally unique id
+    - `deltas`: the most recent changes (at most PARTITION_DELTA_LOG_SIZE), oldest first,
+      as (base_version, version, ((agent_id, old_task_id, new_task_id), ...)); shared (immutable) between copies and messages
+    Both maps are only changed through the methods, which keep them in sync and record the changes.
+    Copies and queries cost O(#agents) or O(1), regardless of the number of tasks.
+    """
+    __slots__ = ('members', 'task_of', 'version', 'deltas')
+
+    def __init__(self):
+        self.members = {}
+        self.task_of = {}
+        self.version = 0
+        self.deltas = ()
+
+    def copy(self):
+        partition = Partition()
+        partition.members = {task_id: members.copy() for task_id, members in self.members.items()}
+        partition.task_of = self.task_of.copy()
+        partition.version = self.version
+        partition.deltas = self.deltas
+        return partition
+
+    def get_task_id(self, agent_id):
+        return self.task_of.get(agent_id)
+
+    def get_members(self, task_id):
+        return self.members.get(task_id, ())
+
+    def get_coalition_size(self, task_id):
+        members = self.members.get(task_id)
+        return len(members) if members is not None else 0
+
+    def assign(self, agent_id, task_id):
+        self.assign_all(((agent_id, task_id),))
+
+    def assign_all(self, assignments):
+        """
+        Assign each (agent_id, task_id) in order, recorded as a single change
+        """
+        changes = []
+        for agent_id, task_id in assignments:
+            old_task_id = self.task_of.get(agent_id)
+            if old_task_id != task_id:
+                self._move(agent_id, old_task_id, task_id)
+                changes.append((agent_id, old_task_id, task_id))
+        if changes:
+            self._record(tuple(changes))
+
+    def discard(self, agent_id):
+        old_task_id = self.task_of.get(agent_id)
+        if old_task_id is not None:
+            self._move(agent_id, old_task_id, None)
+            self._record(((agent_id, old_task_id, None),))
+
+    def clear(self, task_id):
+        changes = tuple((agent_id, task_id, None) for agent_id in self.members.get(task_id, ()))
+        for agent_id, _, _ in changes:
+            self._move(agent_id, task_id, None)
+        if changes:
+            self._record(changes)
+
+    def _move(self, agent_id, old_task_id, new_task_id):
+        if old_task_id is not None:
+            members = self.members[old_task_id]
+            members.discard(agent_id)
+            if not members:
+                del self.members[old_task_id]
+        if new_task_id is None:
+            del self.task_of[agent_id]
+        else:
+            self.members.setdefault(new_task_id, set()).add(agent_id)
+            self.task_of[agent_id] = new_task_id
+
+    def _record(self, changes):
+        version = next(partition_versions)
+        deltas = (self.deltas + ((self.version, version, changes),))[-PARTITION_DELTA_LOG_SIZE:] if PARTITION_DELTA_LOG_SIZE > 0 else ()
+        self._set_version(version, deltas)
+
+    def _set_version(self, version, deltas):
+        self.version = version
+        self.deltas = deltas
+
+    def sync_to(self, version, deltas):
+        """
+        Reconstruct the partition state `version` from its change log `deltas` (as published by another agent):
+        undo my own recent changes back to a state in that log, then replay the changes after it. O(#changes).
+        Returns False (nothing changed) if there is no such common state within the logs; a full sync is needed then.
+        """
+        if version == self.version:
+            return True
+        common_state = Partition.find_common_state(self.version, self.deltas, version, deltas)
+        if common_state is None:
+            return False
+        undo_count, replay_index = common_state
+        own_deltas = self.deltas
+        moves = []
+        for _, _, changes in reversed(own_deltas[len(own_deltas) - undo_count:]):
+            moves.extend((agent_id, new_task_id, old_task_id) for agent_id, old_task_id, new_task_id in reversed(changes))
+        for _, _, changes in deltas[replay_index:]:
+            moves.extend(changes)
+        for agent_id, old_task_id, new_task_id in moves:
+            self._move(agent_id, old_task_id, new_task_id)
+        self._set_version(version, deltas)
+        return True
+
+    @staticmethod
+    def find_common_state(own_version, own_deltas, version, deltas):
+        """
+        How to get from the state `own_version` to the state `version` through their logs:
+        (the number of own changes to undo, the index in `deltas` of the first change to replay), or None if the logs share no state
+        """
+        if version == own_version:
+            return 0, len(deltas)
+        base_index = {entry[0]: index for index, entry in enumerate(deltas)}
+        current, undo_count = own_version, 0
+        while current not in base_index:
+            if undo_count == len(own_deltas) or own_deltas[-1 - undo_count][1] != current:
+                return None
+            current = own_deltas[-1 - undo_count][0]
+            undo_count += 1
+            if current == version: # `version` is an ancestor of mine
+                return undo_count, len(deltas)
+        return undo_count, base_index[current]
+
+    def adopt(self, partition):
+        """
+        Full sync: take over the state of `partition` (a copy), O(#agents)
+        """
+        self.members = partition.members
+        self.task_of = partition.task_of
+        self._set_version(partition.version, partition.deltas)
+
+    def get_assignment_array(self, num_agents):
+        """
+        Compact form: task_id of each agent_id (-1: no coalition)
+        """
+        assignment = np.full(num_agents, -1, dtype=np.int64)
+        if self.task_of:
+            assignment[list(self.task_of.keys())] = list(self.task_of.values())
+        return assignment
+
+    def get_coalition_size_array(self, num_tasks):
+        """
+        Compact form: coalition size of each task_id
+        """
+        assignment = np.fromiter(self.task_of.values(), dtype=np.int64, count=len(self.task_of))
+        return np.bincount(assignment, minlength=num_tasks)
+
 
 class GRAPE:
     def __init__(self, agent):
@@ -14,35 +175,68 @@ class GRAPE:
         self.satisfied = False
         self.evolution_number = 0  # Initialize evolution_number
         self.time_stamp = 0  # Initialize time_stamp            
-        self.partition = {task.task_id: set() for task in self.agent.tasks_info}  # Initialize partition with emptysets        
-        self.assigned_task = None
+        self.partition = Partition()  # Initialize partition with empty coalitions
+        self.assigned_task_watch = TaskCompletionWatch()
         _local_tasks_info = self.agent.get_tasks_nearby()
         _local_agents_info = self.agent.get_agents_nearby()
         if INITIALIZE_PARTITION == "Distance": 
             if _local_tasks_info and _local_agents_info:                                
-                self.partition = self.initialize_partition_by_distance(_local_agents_info, _local_tasks_info, self.partition)
+                self.partition.adopt(self.get_initial_partition(_local_agents_info, _local_tasks_info))
                 self.assigned_task = self.get_assigned_task_from_partition(self.partition)                 
 
-        self.current_utilities = {}
-        self.agent.message_to_share = { # Message Initialization
-            'agent_id': self.agent.agent_id,
-            'partition': self.partition, 
-            'evolution_number': self.evolution_number,
-            'time_stamp': self.time_stamp
-            } 
-
-
-    def initialize_partition_by_distance(self, agents_info, tasks_info, partition):
-        for agent in agents_info:
-            task_distance = {task.task_id: float('inf') if task.completed else (agent.position - task.position).length() for task in tasks_info}
-            if len(task_distance) > 0:
-                preferred_task_id = min(task_distance, key=task_distance.get)
-                self.partition.setdefault(preferred_task_id, set()) # Ensure the task_id key exists in the partition. Set tis value as empty set if it doesn't already exist (This is for dynamic task generation)
-                partition[preferred_task_id].add(agent.agent_id)
+        self.current_utilities = np.zeros(0) # Utilities of the last evaluated local tasks (aligned with them)
+        self.processed_messages = {} # key: sender agent_id; value: its last message considered by D-Mutex
+        self.full_sync_request = None # agent_id of the neighbor whose partition I wait for (see `distributed_mutex()`)
+        self.snapshot_requested = False # True if a neighbor waits for my partition
+        self.publish_message() # Message Initialization
+
+    @property
+    def assigned_task(self):
+        return self.assigned_task_watch.task
+
+    @assigned_task.setter
+    def assigned_task(self, task):
+        # Subscribes to the task's `TaskCompleted` (see `TaskCompletionWatch`)
+        self.assigned_task_watch.watch(task)
+
+
+    def get_initial_partition(self, agents_info, tasks_info):
+        """
+        A copy of the distance-based initial partition for this view (`agents_info`, `tasks_info`).
+        Computed once per view from the shared cost matrix and shared by all agents with the same view
+        (e.g., all agents with global communication and situation awareness), including its version.
+        """
+        scenario = (id(cost_matrix.agents), cost_matrix.tick)
+        if initial_partition_cache['scenario'] != scenario:
+            initial_partition_cache['scenario'] = scenario
+            initial_partition_cache['partitions'] = {}
+        key = (tuple(agent.agent_id for agent in agents_info), tuple(task.task_id for task in tasks_info))
+        partition = initial_partition_cache['partitions'].get(key)
+        if partition is None:
+            distances = cost_matrix.get_distance_block(agents_info, tasks_info)
+            partition = initial_partition_cache['partitions'][key] = self.initialize_partition_by_distance(agents_info, tasks_info, Partition(), distances)
+        return partition.copy()
+
+    def initialize_partition_by_distance(self, agents_info, tasks_info, partition, distances=None):
+        """
+        Each agent in `agents_info` joins the coalition of its nearest task in `tasks_info` (completed tasks excluded).
+        `distances`: (agents x tasks) array; computed from the current positions if not given
+        """
+        if not agents_info or not tasks_info:
+            return partition
+        if distances is None:
+            agent_positions = np.array([(agent.position.x, agent.position.y) for agent in agents_info], dtype=float)
+            task_positions = np.array([(task.position.x, task.position.y) for task in tasks_info], dtype=float)
+            dx = agent_positions[:, 0, None] - task_positions[None, :, 0]
+            dy = agent_positions[:, 1, None] - task_positions[None, :, 1]
+            distances = np.sqrt(dx * dx + dy * dy)
+        completed = np.fromiter((task.completed for task in tasks_info), dtype=bool, count=len(tasks_info))
+        nearest = np.where(completed, float('inf'), distances).argmin(axis=1) # The first task if all are completed
+        partition.assign_all((agent.agent_id, tasks_info[col].task_id) for agent, col in zip(agents_info, nearest.tolist())) # One delta for the whole (re)initialization
         return partition
 
     def get_neighbor_agents_info_in_partition(self, partition):
-        _neighbor_agents_info = [neighbor_agent for neighbor_agent in self.agent.agents_info if neighbor_agent.agent_id in partition[self.assigned_task.task_id]]
+        _neighbor_agents_info = [self.agent.agents_info[agent_id] for agent_id in sorted(partition.get_members(self.assigned_task.task_id))]
         return _neighbor_agents_info
 
     def decide(self, blackboard):
@@ -55,10 +249,10 @@ class GRAPE:
         _local_tasks_info = blackboard['local_tasks_info']
         
         # Check if the existing task is done        
-        if self.assigned_task is not None and self.assigned_task.completed:            
+        if self.assigned_task_watch.completed:            
             _neighbor_agents_info = self.get_neighbor_agents_info_in_partition(self.partition)    
             # Default routine
-            self.partition[self.assigned_task.task_id] = set()  # Empty the previous task's coalition                  
+            self.partition.clear(self.assigned_task.task_id)  # Empty the previous task's coalition
             self.assigned_task = None
             self.satisfied = False
             
@@ -86,12 +280,7 @@ class GRAPE:
             self.satisfied = True
 
             # Broadcasting # NOTE: Implemented separately
-            self.agent.message_to_share = {
-                'agent_id': self.agent.agent_id,
-                'partition': self.partition, 
-                'evolution_number': self.evolution_number,
-                'time_stamp': self.time_stamp
-                }
+            self.publish_message()
             
             return None
 
@@ -99,6 +288,8 @@ class GRAPE:
         # D-Mutex (Phase 2)            
         self.evolution_number, self.time_stamp, self.partition, self.satisfied = self.distributed_mutex(self.agent.messages_received)                
         self.agent.reset_messages_received()
+        if self.snapshot_requested:
+            self.publish_message() # Serve the full sync requested by a neighbor
 
         self.assigned_task = self.get_assigned_task_from_partition(self.partition)        
 
@@ -111,63 +302,106 @@ class GRAPE:
 
 
 
-    def discard_myself_from_coalition(self, task):
-        if task is not None:
-            self.partition[task.task_id].discard(self.agent.agent_id)
-
-
-    
     def update_partition(self, preferred_task_id):                
-        self.discard_myself_from_coalition(self.assigned_task)            
-        self.partition[preferred_task_id].add(self.agent.agent_id)
+        self.partition.assign(self.agent.agent_id, preferred_task_id) # Also leaves the current coalition
 
     def find_max_utility_task(self, tasks_info):
-        _current_utilities = {
-            task.task_id: self.compute_utility(task) if not task.completed else float('-inf')
-            for task in tasks_info
-        }
+        _current_utilities = self.compute_utilities(tasks_info, cost_matrix.get_distances(self.agent, tasks_info))
 
-        _max_task_id = max(_current_utilities, key=_current_utilities.get)
-        _max_utility = _current_utilities[_max_task_id]
+        _max_index = int(np.argmax(_current_utilities)) # The first one in case of a tie
+        _max_task_id = tasks_info[_max_index].task_id
+        _max_utility = float(_current_utilities[_max_index])
 
         self.current_utilities = _current_utilities
 
         return _max_task_id, _max_utility
 
-    def compute_utility(self, task): # Individual Utility Function  
+    def compute_utilities(self, tasks_info, distances): # Individual Utility Function (vectorized over the tasks; -inf for completed tasks)
+        task_ids = np.fromiter((task.task_id for task in tasks_info), dtype=np.int64, count=len(tasks_info))
+        my_task_id = self.partition.get_task_id(self.agent.agent_id)
+        coalition_sizes = self.partition.get_coalition_size_array(max(len(self.agent.tasks_info), int(task_ids.max()) + 1))
+        num_collaborators = coalition_sizes[task_ids] + (task_ids != (my_task_id if my_task_id is not None else -1))
+        utilities = coalition_utility(distances, get_task_amounts(tasks_info), num_collaborators, COST_WEIGHT_FACTOR, SOCIAL_INHIBITION_FACTOR)
+        utilities[np.fromiter((task.completed for task in tasks_info), dtype=bool, count=len(tasks_info))] = float('-inf')
+        return utilities
+
+    def compute_utility(self, task, distance=None): # Individual Utility Function  
         if task is None:
             return float('-inf')
 
-        self.partition.setdefault(task.task_id, set()) # Ensure the task_id key exists in the partition. Set tis value as empty set if it doesn't already exist (This is for dynamic task generation)
-        num_collaborator = len(self.partition[task.task_id])
-        if self.agent.agent_id not in self.partition[task.task_id]:
+        num_collaborator = self.partition.get_coalition_size(task.task_id)
+        if self.partition.get_task_id(self.agent.agent_id) != task.task_id:
             num_collaborator += 1
 
-        distance = (self.agent.position - task.position).length()              
+        if distance is None:
+            distance = (self.agent.position - task.position).length()              
         utility = task.amount / (num_collaborator) - COST_WEIGHT_FACTOR * distance * (num_collaborator ** SOCIAL_INHIBITION_FACTOR) 
         return utility
 
+    def publish_message(self):
+        """
+        Broadcast the partition as its version and recent changes (`Partition.deltas`), not as a whole;
+        a copy of the whole partition is attached only if a neighbor needs a full sync (see `is_snapshot_needed()`)
+        """
+        self.agent.message_to_share = {
+            'agent_id': self.agent.agent_id,
+            'evolution_number': self.evolution_number,
+            'time_stamp': self.time_stamp,
+            'partition_version': self.partition.version,
+            'partition_deltas': self.partition.deltas,
+            'partition_snapshot': self.partition.copy() if self.is_snapshot_needed() else None,
+            'full_sync_request': self.full_sync_request
+            }
+        self.snapshot_requested = False
+
+    def is_snapshot_needed(self):
+        """
+        True if a neighbor requested a full sync, or if my recent changes cannot bring a neighbor behind me (as of its last message) to my partition
+        """
+        if self.snapshot_requested:
+            return True
+        for message in self.processed_messages.values():
+            if (message['evolution_number'], message['time_stamp']) < (self.evolution_number, self.time_stamp) and \
+                    Partition.find_common_state(message['partition_version'], message['partition_deltas'], self.partition.version, self.partition.deltas) is None:
+                return True
+        return False
+
     def distributed_mutex(self, messages_received):        
         _satisfied = True
         _evolution_number = self.evolution_number
-        _partition = self.partition
         _time_stamp = self.time_stamp
+        _winning_message = None
         
         for message in messages_received:
+            # A message already considered cannot win again, since my (evolution_number, time_stamp) never decreases
+            if self.processed_messages.get(message['agent_id']) is message:
+                continue
+            self.processed_messages[message['agent_id']] = message
+            if message['full_sync_request'] == self.agent.agent_id:
+                self.snapshot_requested = True
             if message['evolution_number'] > _evolution_number or (message['evolution_number'] == _evolution_number and message['time_stamp'] > _time_stamp):
                 _evolution_number = message['evolution_number']
                 _time_stamp = message['time_stamp']
-                _partition = message['partition']
+                _winning_message = message
 
                 _satisfied = False
-        
-        _final_partition = {k: v.copy() for k, v in _partition.items()}
-        return _evolution_number, _time_stamp, _final_partition, _satisfied
-                
+
+        _partition = self.partition
+        if _winning_message is not None:
+            # Adopt the winning partition: replay its changes on mine, or take its snapshot if I am too far behind
+            if not _partition.sync_to(_winning_message['partition_version'], _winning_message['partition_deltas']):
+                if _winning_message['partition_snapshot'] is None:
+                    # Full sync: keep my state and ask the sender for its partition, which comes with one of its next messages
+                    self.full_sync_request = _winning_message['agent_id']
+                    self.publish_message()
+                    return self.evolution_number, self.time_stamp, _partition, self.satisfied
+                _partition.adopt(_winning_message['partition_snapshot'].copy())
+            self.full_sync_request = None
+        return _evolution_number, _time_stamp, _partition, _satisfied
 
     def get_assigned_task_from_partition(self, partition):
         
-        _assigned_task_id = next((task_id for task_id, coalition_members_id in partition.items() if self.agent.agent_id in coalition_members_id), None)
+        _assigned_task_id = partition.get_task_id(self.agent.agent_id)
         _assigned_task = self.agent.tasks_info[_assigned_task_id] if _assigned_task_id is not None else None
         return _assigned_task
         
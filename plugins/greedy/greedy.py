@@ -1,6 +1,9 @@
 import random
 import pygame
+import numpy as np
 from modules.utils import config
+from modules.events import TaskCompletionWatch
+from modules.cost_matrix import cost_matrix, get_task_amounts, amount_minus_cost
 MODE = config['decision_making']['FirstClaimGreedy']['mode']
 W_FACTOR_COST = config['decision_making']['FirstClaimGreedy']['weight_factor_cost']
 ENFORCED_COLLABORATION = config['decision_making']['FirstClaimGreedy'].get('enforced_collaboration', False)
@@ -8,7 +11,16 @@ ENFORCED_COLLABORATION = config['decision_making']['FirstClaimGreedy'].get('enfo
 class FirstClaimGreedy: # Task selection within each agent's `situation_awareness_radius`
     def __init__(self, agent):
         self.agent = agent
-        self.assigned_task = None
+        self.assigned_task_watch = TaskCompletionWatch()
+
+    @property
+    def assigned_task(self):
+        return self.assigned_task_watch.task
+
+    @assigned_task.setter
+    def assigned_task(self, task):
+        # Subscribes to the task's `TaskCompleted` (see `TaskCompletionWatch`)
+        self.assigned_task_watch.watch(task)
 
     def decide(self, blackboard):
         # Place your decision-making code for each agent
@@ -20,16 +32,13 @@ class FirstClaimGreedy: # Task selection within each agent's `situation_awarenes
         local_tasks_info = blackboard['local_tasks_info']
         
         # Check if the existing task is done
-        if self.assigned_task is not None and self.assigned_task.completed:
+        if self.assigned_task_watch.completed:
             self.assigned_task = None
 
         # Give up the decision-making process if there is no task nearby 
         if len(local_tasks_info) == 0: 
             self.assigned_task = None
-            self.agent.message_to_share = {
-                'agent_id': self.agent.agent_id,
-                'assigned_task_id': None
-            }            
+            self.share_assigned_task_id(None)
             return None
         
         # Given that there is only one task nearby, then enforced to select this
@@ -43,10 +52,7 @@ class FirstClaimGreedy: # Task selection within each agent's `situation_awarenes
             self.agent.reset_messages_received()
             if len(unassigned_tasks_info) == 0:
                 self.assigned_task = None
-                self.agent.message_to_share = {
-                    'agent_id': self.agent.agent_id,
-                    'assigned_task_id': None
-                }
+                self.share_assigned_task_id(None)
                 return None
             
 
@@ -61,17 +67,21 @@ class FirstClaimGreedy: # Task selection within each agent's `situation_awarenes
                 
             self.assigned_task = self.agent.tasks_info[target_task_id]            
 
-            self.agent.message_to_share = {
-                'agent_id': self.agent.agent_id,
-                'assigned_task_id': self.assigned_task.task_id
-                }
+            self.share_assigned_task_id(self.assigned_task.task_id)
         
         return self.assigned_task.task_id  
 
+    def share_assigned_task_id(self, task_id):
+        # Broadcast only when the claim changes so that neighbors are not woken up by identical messages
+        if self.agent.message_to_share.get('assigned_task_id', -1) == task_id:
+            return
+        self.agent.message_to_share = {
+            'agent_id': self.agent.agent_id,
+            'assigned_task_id': task_id
+            }
+
     def filter_unassigned_tasks_from_neighbor_messages(self, tasks_info):
-        occupied_tasks_id = []
-        for message in self.agent.messages_received:
-            occupied_tasks_id.append(message.get('assigned_task_id'))
+        occupied_tasks_id = {message.get('assigned_task_id') for message in self.agent.messages_received}
 
         unassigned_tasks = [task for task in tasks_info if task.task_id not in occupied_tasks_id]        
 
@@ -79,22 +89,21 @@ class FirstClaimGreedy: # Task selection within each agent's `situation_awarenes
 
 
     def find_min_dist_task(self, tasks_info):
-        _tasks_distance = {
-            task.task_id: self.compute_distance(task) if not task.completed else float('inf')
-            for task in tasks_info
-        }
-        _min_task_id = min(_tasks_distance, key=_tasks_distance.get)
+        _tasks_distance = cost_matrix.get_distances(self.agent, tasks_info)
+        _tasks_distance[self.get_completed_mask(tasks_info)] = float('inf')
+        _min_task_id = tasks_info[int(np.argmin(_tasks_distance))].task_id
         return _min_task_id
 
     def find_max_utility_task(self, tasks_info):
-        _current_utilities = {
-            task.task_id: self.compute_utility(task) if not task.completed else float('-inf')
-            for task in tasks_info
-        }
+        _current_utilities = amount_minus_cost(cost_matrix.get_distances(self.agent, tasks_info), get_task_amounts(tasks_info), W_FACTOR_COST)
+        _current_utilities[self.get_completed_mask(tasks_info)] = float('-inf')
 
-        _max_task_id = max(_current_utilities, key=_current_utilities.get)        
+        _max_task_id = tasks_info[int(np.argmax(_current_utilities))].task_id
 
         return _max_task_id
+
+    def get_completed_mask(self, tasks_info):
+        return np.fromiter((task.completed for task in tasks_info), dtype=bool, count=len(tasks_info))
     
     def compute_utility(self, task): # Individual Utility Function  
         if task is None:
@@ -109,4 +118,87 @@ class FirstClaimGreedy: # Task selection within each agent's `situation_awarenes
 
         distance = (self.agent.position - task.position).length()        
         return distance
-        
\ No newline at end of file
+
+
+class CentralizedFirstClaimGreedy(FirstClaimGreedy): # The same policies for the whole swarm in one call per tick
+    """
+    `FirstClaimGreedy` executed by `decide_batch()` (requires `decision_making.delegate_to_plugin: True`).
+    - The `MinDist`/`MaxUtil` scores of all deciding agents come from one array expression over the shared distance matrix
+    - Claims are known to every agent: the agents decide in agent order, each skipping the tasks claimed by the others so far,
+      so an earlier agent wins a conflict (the sequential `decide()` loop with every agent hearing every other agent)
+    - The claims are read from every agent's broadcast, so the received messages are discarded instead of delivered
+    """
+    @classmethod
+    def decide_batch(cls, agent_views, blackboards):
+        local_task_mask = agent_views.local_task_mask
+        task_list = agent_views.task_list
+        task_columns = agent_views.cost_matrix.task_columns
+        decision_makers = agent_views.decision_makers
+
+        # Broadcast claims: the claimed column of each agent (-1: none or not a live task) and the number of claims per column
+        claimed_columns = np.array([task_columns.get(decision_maker.agent.message_to_share.get('assigned_task_id'), -1) for decision_maker in decision_makers], dtype=np.int64)
+        claim_counts = np.bincount(claimed_columns[claimed_columns >= 0], minlength=len(task_list))
+        num_local_tasks = local_task_mask.sum(axis=1)
+
+        # Agents looking for a task in this tick (see `decide()`)
+        for agent_id in np.flatnonzero(agent_views.active):
+            decision_maker = decision_makers[agent_id]
+            if decision_maker.assigned_task_watch.completed:
+                decision_maker.assigned_task = None
+        selecting = agent_views.active & np.array([decision_maker.assigned_task is None for decision_maker in decision_makers], dtype=bool) & (num_local_tasks > (1 if ENFORCED_COLLABORATION else 0))
+        selecting_rows = np.flatnonzero(selecting)
+        scores = cls.compute_scores(agent_views.distances[selecting_rows], task_list) # None for `Random`
+        score_rows = dict(zip(selecting_rows.tolist(), range(len(selecting_rows))))
+
+        # Sequential first-claim resolution in agent order
+        task_ids = []
+        for agent_id, decision_maker in enumerate(decision_makers):
+            decision_maker.agent.discard_messages_received() # The claims are read from the broadcasts above
+            if agent_views.active[agent_id]:
+                agent_scores = scores[score_rows[agent_id]] if scores is not None and agent_id in score_rows else None
+                cls.decide_in_batch(decision_maker, agent_id, local_task_mask[agent_id], num_local_tasks[agent_id], task_list, agent_scores, claimed_columns, claim_counts)
+            task_ids.append(decision_maker.assigned_task.task_id if decision_maker.assigned_task is not None else None)
+        return task_ids
+
+    @staticmethod
+    def compute_scores(distances, task_list):
+        # Higher is better; rows follow the given distance rows
+        if MODE == "MinDist":
+            return -distances
+        elif MODE == "MaxUtil":
+            return amount_minus_cost(distances, get_task_amounts(task_list), W_FACTOR_COST)
+
+    @staticmethod
+    def decide_in_batch(decision_maker, agent_id, local_mask, num_local_tasks, task_list, scores, claimed_columns, claim_counts):
+        # One agent's `decide()` on the batch inputs; updates the claims in place
+        if num_local_tasks == 0:
+            decision_maker.assigned_task = None
+            decision_maker.share_assigned_task_id(None)
+            selected_column = -1
+        elif ENFORCED_COLLABORATION and num_local_tasks == 1:
+            decision_maker.assigned_task = task_list[int(np.argmax(local_mask))]
+            return
+        elif decision_maker.assigned_task is None:
+            # The agent's own claim does not occupy a task for itself
+            if claimed_columns[agent_id] >= 0:
+                claim_counts[claimed_columns[agent_id]] -= 1
+                claimed_columns[agent_id] = -1
+            unassigned = local_mask & (claim_counts == 0)
+            if not unassigned.any():
+                decision_maker.share_assigned_task_id(None)
+                selected_column = -1
+            else:
+                if MODE == "Random":
+                    selected_column = int(random.choice(np.flatnonzero(unassigned)))
+                else:
+                    selected_column = int(np.argmax(np.where(unassigned, scores, -np.inf)))
+                decision_maker.assigned_task = task_list[selected_column]
+                decision_maker.share_assigned_task_id(decision_maker.assigned_task.task_id)
+        else:
+            return
+
+        if claimed_columns[agent_id] >= 0:
+            claim_counts[claimed_columns[agent_id]] -= 1
+        claimed_columns[agent_id] = selected_column
+        if selected_column >= 0:
+            claim_counts[selected_column] += 1
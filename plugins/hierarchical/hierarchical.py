@@ -0,0 +1,296 @@
+import math
+import importlib
+import numpy as np
+from modules.utils import config
+from modules.cost_matrix import cost_matrix
+
+INNER_PLUGIN = config['decision_making']['Hierarchical']['plugin'] # The plugin run within each cluster (configured by its own section)
+CLUSTERING = config['decision_making']['Hierarchical'].get('clustering', 'Grid') # Options: Grid; KMeans
+CELL_SIZE = config['decision_making']['Hierarchical'].get('cell_size', 400) # Grid: the width and height of a cell
+AGENTS_PER_CLUSTER = config['decision_making']['Hierarchical'].get('agents_per_cluster', 50) # KMeans
+TASKS_PER_GROUP = config['decision_making']['Hierarchical'].get('tasks_per_group', 50) # KMeans
+KMEANS_ITERATIONS = config['decision_making']['Hierarchical'].get('kmeans_iterations', 10)
+RECLUSTERING_INTERVAL = config['decision_making']['Hierarchical'].get('reclustering_interval', 100) # sec
+SAMPLING_FREQ = config['simulation']['sampling_freq']
+
+inner_module_path, inner_class_name = INNER_PLUGIN.rsplit('.', 1)
+inner_module = importlib.import_module(inner_module_path)
+inner_class = getattr(inner_module, inner_class_name)
+
+
+def get_positions(objects):
+    return np.array([(obj.position.x, obj.position.y) for obj in objects], dtype=float).reshape(-1, 2)
+
+def get_squared_distances(points, centroids):
+    return ((points[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+
+def get_tasks_within(agent, tasks, radius=None):
+    # The tasks within the radius of the agent (`situation_awareness_radius` by default; all if 0), as in `Agent.get_tasks_nearby()`
+    radius = agent.situation_awareness_radius if radius is None else radius
+    if radius <= 0:
+        return list(tasks)
+    radius_squared = radius ** 2
+    return [task for task in tasks if (agent.position - task.position).length_squared() <= radius_squared]
+
+def grid_clusters(positions, cell_size):
+    """
+    Labels (0..K-1) of the occupied grid cells, and the centroids of their points
+    """
+    cells = np.floor(positions / cell_size).astype(np.int64)
+    _, labels = np.unique(cells, axis=0, return_inverse=True)
+    labels = labels.reshape(-1)
+    return labels, get_centroids(positions, labels, labels.max(initial=-1) + 1)
+
+def kmeans_clusters(positions, k, iterations, centroids=None):
+    """
+    Lloyd's k-means, warm-started from `centroids` if given (with k rows); empty clusters are dropped, so the labels are 0..K-1 (K <= k)
+    """
+    if centroids is None or len(centroids) != k:
+        centroids = positions[np.linspace(0, len(positions) - 1, k).astype(np.int64)]
+    for _ in range(iterations):
+        labels = get_squared_distances(positions, centroids).argmin(axis=1)
+        centroids = np.where(np.bincount(labels, minlength=k)[:, None] > 0, get_centroids(positions, labels, k), centroids)
+    labels = get_squared_distances(positions, centroids).argmin(axis=1)
+    used, labels = np.unique(labels, return_inverse=True)
+    return labels.reshape(-1), centroids[used]
+
+def get_centroids(positions, labels, k):
+    counts = np.maximum(np.bincount(labels, minlength=k), 1)
+    return np.stack([np.bincount(labels, weights=positions[:, axis], minlength=k) for axis in range(2)], axis=1) / counts[:, None]
+
+def allocate_task_groups(group_centroids, group_sizes, cluster_centroids, cluster_sizes):
+    """
+    Coarse allocation: the agent cluster of each task group.
+    Closest pairs first, while the cluster has agents left for the tasks; the groups left over go to the closest cluster.
+    """
+    squared_distances = get_squared_distances(group_centroids, cluster_centroids)
+    allocation = np.full(len(group_centroids), -1, dtype=np.int64)
+    capacities = cluster_sizes.astype(np.int64).copy()
+    for pair in np.argsort(squared_distances, axis=None, kind='stable'):
+        group, cluster = divmod(int(pair), len(cluster_centroids))
+        if allocation[group] < 0 and capacities[cluster] > 0:
+            allocation[group] = cluster
+            capacities[cluster] -= group_sizes[group]
+            if not (capacities > 0).any() or (allocation >= 0).all():
+                break
+    left_over = allocation < 0
+    allocation[left_over] = squared_distances[left_over].argmin(axis=1)
+    return allocation
+
+
+# Spatial clusters of the agents and the tasks allocated to each cluster (shared by all agents)
+class ClusterMap:
+    """
+    - `agent_clusters[agent_id]`: the cluster of the agent, fixed until the next reclustering
+    - `cluster_members[cluster]`: the agent ids of the cluster (a set)
+    - `cluster_tasks[cluster]`: the tasks allocated to the cluster; tasks generated in between join the cluster of their task group
+    - `cluster_keys[cluster]`: the members and the allocated task ids of the cluster when it was built, to tell whether it changed
+    Rebuilt every `RECLUSTERING_INTERVAL` sec by the first agent deciding in the tick.
+    """
+    def __init__(self):
+        self.built_tick = None
+        self.agent_clusters = np.zeros(0, dtype=np.int64)
+        self.cluster_members = []
+        self.cluster_centroids = np.zeros((0, 2))
+        self.cluster_tasks = []
+        self.cluster_keys = []
+        self.group_centroids = np.zeros((0, 2))
+        self.group_clusters = np.zeros(0, dtype=np.int64)
+        self.num_tasks = 0 # The number of tasks allocated so far (`tasks_info` only grows)
+        self.live_tasks = {} # key: cluster; value: (tick, live tasks of the cluster)
+
+    def update(self, agent):
+        """
+        Returns True if the clusters were rebuilt
+        """
+        interval_ticks = max(int(round(RECLUSTERING_INTERVAL * SAMPLING_FREQ)), 1)
+        if self.built_tick is None or cost_matrix.tick - self.built_tick >= interval_ticks:
+            self.build(agent.agents_info, agent.tasks_info)
+            return True
+        if len(agent.tasks_info) > self.num_tasks:
+            self.allocate_new_tasks(agent.tasks_info)
+        return False
+
+    def build(self, agents_info, tasks_info):
+        self.built_tick = cost_matrix.tick
+        self.live_tasks = {}
+        agent_positions = get_positions(agents_info)
+        if CLUSTERING == "KMeans":
+            num_clusters = max(math.ceil(len(agents_info) / AGENTS_PER_CLUSTER), 1)
+            self.agent_clusters, self.cluster_centroids = kmeans_clusters(agent_positions, num_clusters, KMEANS_ITERATIONS, self.cluster_centroids)
+        else:
+            self.agent_clusters, self.cluster_centroids = grid_clusters(agent_positions, CELL_SIZE)
+        self.cluster_members = [set() for _ in range(len(self.cluster_centroids))]
+        for agent_id, cluster in enumerate(self.agent_clusters.tolist()):
+            self.cluster_members[cluster].add(agent_id)
+
+        # Task groups, allocated to the agent clusters
+        tasks = [task for task in tasks_info if not task.completed]
+        self.cluster_tasks = [[] for _ in range(len(self.cluster_centroids))]
+        self.num_tasks = len(tasks_info)
+        if not tasks:
+            self.group_centroids = np.zeros((0, 2))
+            self.group_clusters = np.zeros(0, dtype=np.int64)
+            self.cluster_keys = [(frozenset(members), frozenset()) for members in self.cluster_members]
+            return
+        task_positions = get_positions(tasks)
+        if CLUSTERING == "KMeans":
+            group_labels, self.group_centroids = kmeans_clusters(task_positions, max(math.ceil(len(tasks) / TASKS_PER_GROUP), 1), KMEANS_ITERATIONS)
+        else:
+            group_labels, self.group_centroids = grid_clusters(task_positions, CELL_SIZE)
+        cluster_sizes = np.bincount(self.agent_clusters, minlength=len(self.cluster_centroids))
+        self.group_clusters = allocate_task_groups(self.group_centroids, np.bincount(group_labels), self.cluster_centroids, cluster_sizes)
+        for task, cluster in zip(tasks, self.group_clusters[group_labels].tolist()):
+            self.cluster_tasks[cluster].append(task)
+        self.cluster_keys = [
+            (frozenset(members), frozenset(task.task_id for task in cluster_tasks))
+            for members, cluster_tasks in zip(self.cluster_members, self.cluster_tasks)
+        ]
+
+    def allocate_new_tasks(self, tasks_info):
+        new_tasks = tasks_info[self.num_tasks:]
+        self.num_tasks = len(tasks_info)
+        self.live_tasks = {}
+        if len(self.group_centroids) == 0:
+            # No task group yet: each new task goes to the closest agent cluster
+            clusters = get_squared_distances(get_positions(new_tasks), self.cluster_centroids).argmin(axis=1)
+        else:
+            clusters = self.group_clusters[get_squared_distances(get_positions(new_tasks), self.group_centroids).argmin(axis=1)]
+        for task, cluster in zip(new_tasks, clusters.tolist()):
+            self.cluster_tasks[cluster].append(task)
+
+    def get_cluster(self, agent_id):
+        return int(self.agent_clusters[agent_id])
+
+    def get_members(self, cluster):
+        return self.cluster_members[cluster]
+
+    def get_cluster_key(self, cluster):
+        return self.cluster_keys[cluster]
+
+    def get_live_tasks(self, cluster):
+        # Computed once per tick for all members of the cluster
+        tick, tasks = self.live_tasks.get(cluster, (None, None))
+        if tick != cost_matrix.tick:
+            tasks = [task for task in self.cluster_tasks[cluster] if not task.completed]
+            self.live_tasks[cluster] = (cost_matrix.tick, tasks)
+        return tasks
+
+
+cluster_map = ClusterMap()
+
+
+# Blackboard view of an agent restricted to its cluster
+class ClusterBlackboard:
+    """
+    `local_tasks_info`: the live tasks allocated to the cluster within the agent's radius; `local_agents_info`: the neighbors in the cluster.
+    Everything else is read from the agent's blackboard.
+    """
+    def __init__(self, blackboard, local_tasks_info, members):
+        self.blackboard = blackboard
+        self.local_tasks_info = local_tasks_info
+        self.members = members
+        self._local_agents_info = None
+
+    @property
+    def local_agents_info(self):
+        if self._local_agents_info is None:
+            self._local_agents_info = [other_agent for other_agent in self.blackboard['local_agents_info'] if other_agent.agent_id in self.members]
+        return self._local_agents_info
+
+    def __getitem__(self, key):
+        if key == 'local_tasks_info':
+            return self.local_tasks_info
+        if key == 'local_agents_info':
+            return self.local_agents_info
+        return self.blackboard[key]
+
+    def get(self, key, default=None):
+        if key in ('local_tasks_info', 'local_agents_info'):
+            return self[key]
+        return self.blackboard.get(key, default)
+
+    def __contains__(self, key):
+        return key in ('local_tasks_info', 'local_agents_info') or key in self.blackboard
+
+    def __getattr__(self, name):
+        return getattr(self.blackboard, name)
+
+
+# Agent as seen by the plugin: its neighbors and tasks are restricted to its cluster
+class ClusterAgentView:
+    """
+    `get_agents_nearby()`: the neighbors in the cluster; `get_tasks_nearby()`: the tasks allocated to the cluster within the radius.
+    Everything else is read from (and assigned to) the agent. `agents_info`/`tasks_info` stay the global lists,
+    since plugins look agents and tasks up by the ids they got from the cluster (messages, partitions, bids).
+    """
+    def __init__(self, agent):
+        object.__setattr__(self, 'agent', agent)
+
+    def get_agents_nearby(self, radius=None):
+        members = cluster_map.get_members(cluster_map.get_cluster(self.agent.agent_id))
+        return [other_agent for other_agent in self.agent.get_agents_nearby(radius) if other_agent.agent_id in members]
+
+    def get_tasks_nearby(self, radius=None, with_completed_task=True):
+        cluster = cluster_map.get_cluster(self.agent.agent_id)
+        tasks = cluster_map.cluster_tasks[cluster] if with_completed_task else cluster_map.get_live_tasks(cluster)
+        return get_tasks_within(self.agent, tasks, radius)
+
+    def __getattr__(self, name):
+        return getattr(self.agent, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.agent, name, value)
+
+
+# Define decision-making class
+class Hierarchical:
+    """
+    Hierarchical allocation around any plugin (`INNER_PLUGIN`, unchanged):
+    - Coarse level: the agents are clustered spatially (grid cells or k-means), and groups of tasks are allocated to the clusters (`ClusterMap`)
+    - Fine level: each agent runs the plugin on the tasks of its cluster, and only receives the messages of its cluster members
+    The per-agent decision cost then depends on the cluster size, not on the density of the world.
+    Messages need the sender's `agent_id` (as those of the bundled plugins do).
+    The plugin runs on a `ClusterAgentView` of the agent. When a reclustering changes the members or the tasks of the agent's cluster,
+    the plugin starts over (see `restart_if_cluster_changed()`), so that none of its state (e.g., a GRAPE partition or CBBA bids)
+    refers to another cluster.
+    """
+    def __init__(self, agent):
+        self.agent = agent
+        self.agent_view = ClusterAgentView(agent)
+        # The clusters exist before the plugin, which may read its neighbors when constructed (e.g., GRAPE's initial partition)
+        cluster_map.update(agent)
+        self.cluster_key = cluster_map.get_cluster_key(cluster_map.get_cluster(agent.agent_id))
+        self.decision_maker = inner_class(self.agent_view)
+
+    def restart_if_cluster_changed(self):
+        cluster_key = cluster_map.get_cluster_key(cluster_map.get_cluster(self.agent.agent_id))
+        if cluster_key != self.cluster_key:
+            self.cluster_key = cluster_key
+            # The previous broadcasts (mine and those already received) refer to the previous clusters
+            self.agent.message_to_share = {}
+            self.agent.discard_messages_received()
+            self.decision_maker = inner_class(self.agent_view)
+
+    def decide(self, blackboard):
+        '''
+        Output:
+            - `task_id`, if task allocation works well
+            - `None`, otherwise
+        '''
+        if cluster_map.update(self.agent):
+            # All plugins restart at once, before any of them reads a message from the previous clusters
+            for agent in self.agent.agents_info:
+                agent.decision_maker.restart_if_cluster_changed()
+        cluster = cluster_map.get_cluster(self.agent.agent_id)
+        members = cluster_map.get_members(cluster)
+
+        # Cluster-local messaging
+        self.agent.messages_received = [message for message in self.agent.messages_received if message.get('agent_id') in members]
+
+        return self.decision_maker.decide(ClusterBlackboard(blackboard, get_tasks_within(self.agent, cluster_map.get_live_tasks(cluster)), members))
+
+
+def draw_decision_making_status(screen, agent):
+    if hasattr(inner_module, 'draw_decision_making_status'):
+        inner_module.draw_decision_making_status(screen, agent)
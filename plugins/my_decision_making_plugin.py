@@ -17,10 +17,14 @@ class MyDecisionMakingClass:
             - `None`, otherwise
         '''        
         # Get local information from the blackboard
+        # (`modules.blackboard.Blackboard`: dict-style access works, and `blackboard.local_tasks_info` is the typed form;
+        #  keys other than the engine's well-known ones are kept in `blackboard.extras`)
         local_tasks_info = blackboard['local_tasks_info']
         local_agents_info = blackboard['local_agents_info']
 
         # Post-process if the previously assigned task is done        
+        # (Alternatively, react to task lifecycle events published by the engine instead of polling, e.g. keep the task in a
+        #  `modules.events.TaskCompletionWatch` as the bundled plugins do, or `event_bus.subscribe(TaskCompleted, handler, task_id=...)`)
         if self.assigned_task is not None and self.assigned_task.completed:            
             # Implement your idea
             pass
@@ -47,4 +51,17 @@ class MyDecisionMakingClass:
             pass
             return self.assigned_task.task_id if self.assigned_task is not None else None
 
+    # (Optional) Batch decision-making for the whole swarm: if defined, the engine calls it once per tick
+    # instead of `decide()` for each agent (`decision_making.delegate_to_plugin: True` is required).
+    # @classmethod
+    # def decide_batch(cls, agent_views, blackboards):
+    #     '''
+    #     Input:
+    #         - `agent_views`: `modules.batch.AgentViews` (positions, active mask, local task mask, distances, messages, decision makers)
+    #         - `blackboards`: list of each agent's blackboard
+    #     Output:
+    #         - list of `task_id` (or `None`) for each agent
+    #     '''
+    #     return [None for _ in agent_views.agents]
+
 